@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Planet benchmark tool.
+
+Times the parts of Planet which are run for every feed on a real corpus
+of feeds, given as files or URLs, to check that changes meant to make
+them faster do, and don't change their results.  A Planet config file
+can be given instead, to use the feeds it lists.
+"""
+
+__license__ = "Python"
+
+
+import sys
+import time
+import shutil
+import tempfile
+import ConfigParser
+
+import planet
+from planet import feedparser
+from planet import fetcher
+from planet import sanitize
+
+
+# Default number of times to repeat each timing
+REPEAT = 10
+
+
+def usage():
+    print "Usage: planet-bench [options] FEED|CONFIGFILE..."
+    print
+    print "Benchmark parts of Planet on a corpus of feeds (files or URLs)."
+    print
+    print "Commands:"
+    print " -D, --dates       Date handler hit rates, and date parsing times"
+    print " -P, --parity      Compare the fast XML parser's results and times"
+    print " -F, --dicts       Parse and update times with each FeedParserDict"
+    print " -S, --sanitize    Compare sanitizing markup in one pass and in two"
+    print " -E, --engines     Compare the results and times of each sanitizer engine"
+    print
+    print "Other Options:"
+    print " --repeat=N        Repeat each timing N times (default %d)" % REPEAT
+    print " -h, --help        Display this help message and exit"
+    sys.exit(0)
+
+def usage_error(msg, *args):
+    print >>sys.stderr, msg, " ".join(args)
+    print >>sys.stderr, "Perhaps you need --help ?"
+    sys.exit(1)
+
+def list_feeds(args):
+    """Return the feeds given, and those listed in any config files given."""
+    feeds = []
+    for arg in args:
+        if arg.endswith(".ini"):
+            config = ConfigParser.ConfigParser()
+            config.read(arg)
+            for section in config.sections():
+                if section.find("://") > 0:
+                    feeds.append(section)
+        else:
+            feeds.append(arg)
+    return feeds
+
+def read_feeds(feeds):
+    """Return the contents of the feeds, fetching them only once.
+
+    feedparser asks servers for compressed feeds, so the body is decoded
+    according to its Content-Encoding, as Channel.fetch() does.
+    """
+    data = []
+    for feed in feeds:
+        try:
+            f = feedparser._open_resource(feed, None, None, planet.USER_AGENT,
+                                          None, [])
+        except KeyboardInterrupt:
+            raise
+        except Exception, e:
+            # Left out by check_feeds(), having no entries
+            print "%-50s unreadable: %s" % (feed[-50:], e)
+            data.append("")
+            continue
+        headers = getattr(f, "headers", None)
+        if headers is not None:
+            body = fetcher.Decoder(headers.get("content-encoding"))
+        else:
+            body = fetcher.Decoder()
+        body.feed(f.read())
+        data.append(body.close())
+        f.close()
+    return data
+
+def check_feeds(feeds, data):
+    """Return the feeds, and their contents, which parse into some entries.
+
+    Comparing or timing the parse of a feed which couldn't be read, or
+    which feedparser found nothing in, would only prove that nothing
+    equals nothing, so those are left out.  Feeds which are bozo but
+    still have entries are kept, as any real corpus has some.  Exits if
+    no feeds are left.
+    """
+    usable = []
+    usable_data = []
+    bozo = 0
+    for feed, feed_data in zip(feeds, data):
+        result = feedparser.parse(feed_data)
+        if not result.entries:
+            print "%-50s skipped: no entries" % feed[-50:]
+            continue
+        if result.bozo:
+            bozo += 1
+            print "%-50s bozo: %s" % (feed[-50:],
+                                      result.get("bozo_exception"))
+        usable.append(feed)
+        usable_data.append(feed_data)
+
+    if len(usable) < len(feeds) or bozo:
+        print "%d of %d feeds skipped, %d bozo" \
+              % (len(feeds) - len(usable), len(feeds), bozo)
+    if not usable:
+        print "No usable feeds"
+        sys.exit(1)
+    return usable, usable_data
+
+def timed(function, repeat):
+    """Return the best time, in seconds, of repeat calls of function."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_dates(data, repeat):
+    """Report date handler hit rates and date parsing times."""
+    # Collect every date string feedparser parses from the corpus
+    dates = []
+    parse_date = feedparser._parse_date
+    def collect(dateString):
+        dates.append(dateString)
+        return parse_date(dateString)
+    feedparser._parse_date = collect
+    try:
+        for feed in data:
+            feedparser.parse(feed)
+    finally:
+        feedparser._parse_date = parse_date
+
+    print "%d date strings, %d distinct" % (len(dates), len(dict.fromkeys(dates)))
+    if not dates:
+        return
+
+    # Which handler parses each date with them in registered order
+    hits = {}
+    tries = {}
+    for dateString in dates:
+        for handler in feedparser._date_handlers:
+            tries[handler.__name__] = tries.get(handler.__name__, 0) + 1
+            if feedparser._tryDateHandler(handler, dateString):
+                hits[handler.__name__] = hits.get(handler.__name__, 0) + 1
+                break
+        else:
+            hits["(none)"] = hits.get("(none)", 0) + 1
+
+    print
+    print "    %-28s %8s %8s %7s" % ("Handler", "Tries", "Parsed", "Rate")
+    for handler in feedparser._date_handlers:
+        name = handler.__name__
+        print "    %-28s %8d %8d %6.1f%%" % (name, tries.get(name, 0),
+                                             hits.get(name, 0),
+                                             100.0 * hits.get(name, 0)
+                                             / len(dates))
+    if hits.has_key("(none)"):
+        print "    %-28s %8s %8d %6.1f%%" % ("(none)", "", hits["(none)"],
+                                             100.0 * hits["(none)"]
+                                             / len(dates))
+
+    # Time parsing them all with each combination of settings
+    settings = (feedparser.DATE_CACHE_SIZE, feedparser.ADAPTIVE_DATE_HANDLERS)
+    results = {}
+    print
+    try:
+        for name, cache_size, adaptive in (
+            ("registered order", 0, 0),
+            ("adaptive order", 0, 1),
+            ("adaptive order, memoized", settings[0] or 1000, 1)):
+            feedparser.DATE_CACHE_SIZE = cache_size
+            feedparser.ADAPTIVE_DATE_HANDLERS = adaptive
+            def run():
+                feedparser._date_cache.clear()
+                feedparser._date_shapes.clear()
+                results[name] = map(feedparser._parse_date, dates)
+            print "    %-28s %8.2fms" % (name, timed(run, repeat) * 1000)
+    finally:
+        feedparser.DATE_CACHE_SIZE, feedparser.ADAPTIVE_DATE_HANDLERS = settings
+        feedparser._date_cache.clear()
+        feedparser._date_shapes.clear()
+
+    expected = results["registered order"]
+    for name, result in results.items():
+        differ = [ i for i in range(len(dates)) if result[i] != expected[i] ]
+        for i in differ[:5]:
+            print "    %s parsed %r as %r, not %r" % (name, dates[i],
+                                                    result[i], expected[i])
+        if differ:
+            print "    %s: %d dates differ" % (name, len(differ))
+
+
+def differences(result, expected):
+    """Return the keys of two feedparser results whose values differ."""
+    keys = []
+    for key in ("feed", "entries", "version", "namespaces", "encoding",
+                "bozo"):
+        if result.get(key) != expected.get(key):
+            keys.append(key)
+    if result.get("bozo_exception").__class__ != \
+           expected.get("bozo_exception").__class__:
+        keys.append("bozo_exception")
+    return keys
+
+def bench_parity(feeds, data, repeat):
+    """Compare results and times of the fast and usual XML parsers."""
+    fast_parse = feedparser._ExpatFeedParser.parse
+    used = []
+    def counted_parse(self, data):
+        fast_parse(self, data)
+        used.append(1)
+
+    setting = feedparser.FAST_XML_PARSER
+    failed = 0
+    usual_time = fast_time = 0.0
+    try:
+        for feed, feed_data in zip(feeds, data):
+            feedparser.FAST_XML_PARSER = 0
+            expected = feedparser.parse(feed_data)
+            usual = timed(lambda: feedparser.parse(feed_data), repeat)
+
+            feedparser.FAST_XML_PARSER = 1
+            del used[:]
+            feedparser._ExpatFeedParser.parse = counted_parse
+            try:
+                result = feedparser.parse(feed_data)
+            finally:
+                feedparser._ExpatFeedParser.parse = fast_parse
+            fast = timed(lambda: feedparser.parse(feed_data), repeat)
+
+            differ = differences(result, expected)
+            if differ:
+                failed += 1
+                status = "DIFFERS in " + ", ".join(differ)
+            elif used:
+                status = "same, fast"
+            else:
+                status = "same, usual parser"
+            print "%-50s %8.2fms %8.2fms  %s" % (feed[-50:], usual * 1000,
+                                                 fast * 1000, status)
+            usual_time += usual
+            fast_time += fast
+    finally:
+        feedparser.FAST_XML_PARSER = setting
+
+    print
+    print "%d feeds, %d differ; %.2fms usual, %.2fms fast" \
+          % (len(feeds), failed, usual_time * 1000, fast_time * 1000)
+    if failed:
+        sys.exit(1)
+
+
+def snapshot(channels):
+    """Return the cached values of the channels and their items.
+
+    Values set from the time of the update are left out, so snapshots
+    of different updates can be compared.
+    """
+    values = []
+    for channel in channels:
+        values.append(dict([ (key, channel.get(key))
+                             for key in channel.keys()
+                             if key not in ("updated", "last_updated") ]))
+        for item in channel.items(hidden=1, sorted=1):
+            values.append(dict([ (key, item.get(key)) for key in item.keys()
+                                 if key not in ("date", "order") ]))
+    return values
+
+def bench_dicts(feeds, data, repeat):
+    """Compare parse and update times with each kind of FeedParserDict."""
+    snapshots = []
+    try:
+        for name, enable in (("UserDict", 0), ("dict", 1)):
+            feedparser.useDictFeedParserDict(enable)
+            directory = tempfile.mkdtemp()
+            try:
+                my_planet = planet.Planet(ConfigParser.ConfigParser())
+                my_planet.cache_directory = directory
+                channels = [ planet.Channel(my_planet, feed) for feed in feeds ]
+
+                infos = map(planet.parse_feed, data)
+                def update():
+                    for channel, info in zip(channels, infos):
+                        channel.update_info(info.feed)
+                        channel.update_entries(info.entries)
+
+                parse_time = timed(lambda: map(planet.parse_feed, data), repeat)
+                update_time = timed(update, repeat)
+                snapshots.append(snapshot(channels))
+                for channel in channels:
+                    channel._cache.close()
+            finally:
+                shutil.rmtree(directory)
+
+            print "%-10s parse %8.2fms  update %8.2fms" \
+                  % (name, parse_time * 1000, update_time * 1000)
+    finally:
+        feedparser.useDictFeedParserDict(0)
+
+    if snapshots[0] != snapshots[1]:
+        print "Cached values differ"
+        sys.exit(1)
+
+
+def stored_values(info):
+    """Return the values Planet stores from a feedparser result, by field."""
+    values = {}
+    items = [ ("feed", info.feed) ]
+    for i in range(len(info.entries)):
+        items.append(("entry %d" % i, info.entries[i]))
+    for name, data in items:
+        for key in data.keys():
+            if key.endswith("_detail"):
+                continue
+            value = data[key]
+            if key == "content":
+                value = [ (item.type, item.value) for item in value ]
+            values[(name, key)] = value
+    return values
+
+def bench_sanitize(feeds, data, repeat):
+    """Compare results and times of sanitizing markup in one pass and two.
+
+    The results aren't expected to be identical; see planet.sanitize_feed()
+    for how they differ.  The stored values which differ are listed so
+    that they can be checked.
+    """
+    setting = feedparser.HTML_SANITIZER
+    results = []
+    times = []
+    try:
+        for sanitizer in (None, sanitize.HTML):
+            feedparser.HTML_SANITIZER = sanitizer
+            results.append(map(planet.parse_feed, data))
+            times.append(timed(lambda: map(planet.parse_feed, data), repeat))
+    finally:
+        feedparser.HTML_SANITIZER = setting
+
+    values = differ = 0
+    for feed, expected, result in zip(feeds, results[0], results[1]):
+        expected = stored_values(expected)
+        result = stored_values(result)
+        keys = expected.keys()
+        keys.sort()
+        values += len(keys)
+        for key in keys:
+            if result.get(key) != expected[key]:
+                differ += 1
+                if differ <= 5:
+                    print "%s %s %s: %r, not %r" % (feed[-40:], key[0], key[1],
+                                                    result.get(key),
+                                                    expected[key])
+
+    entries = 0
+    for info in results[0]:
+        entries += len(info.entries)
+    print "%d feeds, %d entries, %d of %d values differ" \
+          % (len(feeds), entries, differ, values)
+    for name, elapsed in (("two passes", times[0]), ("single pass", times[1])):
+        print "%-12s %8.2fms  %8.3fms per entry" \
+              % (name, elapsed * 1000, elapsed * 1000 / max(entries, 1))
+
+def bench_engines(data, repeat):
+    """Compare results and times of the sgmllib and regex sanitizers."""
+    # Collect the markup sanitized for the corpus, with and without the
+    # base URIs used for a single pass
+    calls = []
+    sanitize_html = sanitize._HTML
+    def collect(htmlSource, encoding='utf8', baseuri=None):
+        calls.append((htmlSource, encoding, baseuri))
+        return sanitize_html(htmlSource, encoding, baseuri)
+    setting = feedparser.HTML_SANITIZER
+    sanitize._HTML = collect
+    try:
+        for sanitizer in (None, sanitize.HTML):
+            feedparser.HTML_SANITIZER = sanitizer
+            for feed in data:
+                planet.parse_feed(feed)
+    finally:
+        sanitize._HTML = sanitize_html
+        feedparser.HTML_SANITIZER = setting
+
+    print "%d values, %d bytes" % (len(calls),
+                                   sum([ len(call[0]) for call in calls ]))
+    if not calls:
+        return
+
+    engine = sanitize.ENGINE
+    results = {}
+    try:
+        for name in ("sgmllib", "regex"):
+            sanitize.ENGINE = name
+            def run():
+                results[name] = []
+                for call in calls:
+                    try:
+                        results[name].append(sanitize_html(*call))
+                    except Exception, e:
+                        results[name].append(e.__class__)
+            print "    %-28s %8.2fms" % (name, timed(run, repeat) * 1000)
+    finally:
+        sanitize.ENGINE = engine
+
+    differ = [ i for i in range(len(calls))
+               if results["regex"][i] != results["sgmllib"][i] ]
+    for i in differ[:5]:
+        print "    regex sanitized %r as %r, not %r" % (calls[i][0][:200],
+                                                       results["regex"][i],
+                                                       results["sgmllib"][i])
+    if differ:
+        print "    %d values differ" % len(differ)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    feeds = []
+    repeat = REPEAT
+
+    command = None
+
+    for arg in sys.argv[1:]:
+        if arg == "-h" or arg == "--help":
+            usage()
+        elif arg == "-D" or arg == "--dates":
+            if command is not None:
+                usage_error("Only one command option may be supplied")
+            command = "dates"
+        elif arg == "-P" or arg == "--parity":
+            if command is not None:
+                usage_error("Only one command option may be supplied")
+            command = "parity"
+        elif arg == "-F" or arg == "--dicts":
+            if command is not None:
+                usage_error("Only one command option may be supplied")
+            command = "dicts"
+        elif arg == "-S" or arg == "--sanitize":
+            if command is not None:
+                usage_error("Only one command option may be supplied")
+            command = "sanitize"
+        elif arg == "-E" or arg == "--engines":
+            if command is not None:
+                usage_error("Only one command option may be supplied")
+            command = "engines"
+        elif arg.startswith("--repeat="):
+            try:
+                repeat = int(arg[len("--repeat="):])
+            except ValueError:
+                usage_error("Invalid repeat count:", arg)
+        elif arg.startswith("-"):
+            usage_error("Unknown option:", arg)
+        else:
+            feeds.append(arg)
+
+    if command is None:
+        usage_error("Missing expected command option")
+    elif not len(feeds):
+        usage_error("Missing expected feeds")
+
+    feeds = list_feeds(feeds)
+    data = read_feeds(feeds)
+    feeds, data = check_feeds(feeds, data)
+
+    if command == "dates":
+        bench_dates(data, repeat)
+    elif command == "parity":
+        bench_parity(feeds, data, repeat)
+    elif command == "dicts":
+        bench_dicts(feeds, data, repeat)
+    elif command == "sanitize":
+        bench_sanitize(feeds, data, repeat)
+    elif command == "engines":
+        bench_engines(data, repeat)
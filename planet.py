@@ -35,6 +35,7 @@ OWNER_NAME  = "Anonymous Coward"
 OWNER_EMAIL = ""
 LOG_LEVEL   = "WARNING"
 FEED_TIMEOUT = 20 # seconds
+STAGGERED_CONNECT = 0
 
 # Default template file list
 TEMPLATE_FILES = "examples/basic/planet.html.tmpl"
@@ -52,6 +53,7 @@ def main():
     config_file = CONFIG_FILE
     offline = 0
     verbose = 0
+    force = 0
 
     for arg in sys.argv[1:]:
         if arg == "-h" or arg == "--help":
@@ -60,6 +62,7 @@ def main():
             print "Options:"
             print " -v, --verbose       DEBUG level logging during update"
             print " -o, --offline       Update the Planet from the cache only"
+            print " -f, --force         Fetch every feed, even those not yet due"
             print " -h, --help          Display this help message and exit"
             print
             sys.exit(0)
@@ -67,6 +70,8 @@ def main():
             verbose = 1
         elif arg == "-o" or arg == "--offline":
             offline = 1
+        elif arg == "-f" or arg == "--force":
+            force = 1
         elif arg.startswith("-"):
             print >>sys.stderr, "Unknown option:", arg
             sys.exit(1)
@@ -91,6 +96,9 @@ def main():
     else:
         log_level  = config_get(config, "Planet", "log_level", LOG_LEVEL)
     feed_timeout   = config_get(config, "Planet", "feed_timeout", FEED_TIMEOUT)
+    connect_delay  = config_get(config, "Planet", "connect_delay", None)
+    staggered_connect = int(config_get(config, "Planet", "staggered_connect",
+                                       STAGGERED_CONNECT))
     template_files = config_get(config, "Planet", "template_files",
                                 TEMPLATE_FILES).split(" ")
 
@@ -141,11 +149,15 @@ def main():
             log.warning("Feed timeout set to invalid value '%s', skipping", feed_timeout)
             feed_timeout = None
 
+    timeoutsocket = None
     if feed_timeout and not offline:
         try:
             from planet import timeoutsocket
             timeoutsocket.setDefaultSocketTimeout(feed_timeout)
             log.debug("Socket timeout set to %d seconds", feed_timeout)
+            if connect_delay is not None:
+                timeoutsocket.setConnectDelay(float(connect_delay))
+            timeoutsocket.setStaggeredConnect(staggered_connect)
         except ImportError:
             import socket
             if hasattr(socket, 'setdefaulttimeout'):
@@ -156,11 +168,15 @@ def main():
                 log.error("Unable to set timeout to %d seconds", feed_timeout)
 
     # run the planet
-    my_planet = planet.Planet(config)
-    my_planet.run(planet_name, planet_link, template_files, offline)
-
-    my_planet.generate_all_files(template_files, planet_name,
-        planet_link, planet_feed, owner_name, owner_email)
+    try:
+        my_planet = planet.Planet(config)
+        my_planet.run(planet_name, planet_link, template_files, offline, force)
+
+        my_planet.generate_all_files(template_files, planet_name,
+            planet_link, planet_feed, owner_name, owner_email)
+    finally:
+        if timeoutsocket:
+            timeoutsocket.setStaggeredConnect(0)
 
 
 if __name__ == "__main__":
@@ -15,7 +15,11 @@ __license__ = "Python"
 
 # Modules available without separate import
 import cache
+import dnscache
 import feedparser
+import fetcher
+import httppool
+import pipeline
 import sanitize
 import htmltmpl
 import sgmllib
@@ -25,15 +29,29 @@ except:
     import compat_logging as logging
 
 # Limit the effect of "from planet import *"
-__all__ = ("cache", "feedparser", "htmltmpl", "logging",
-           "Planet", "Channel", "NewsItem")
+__all__ = ("cache", "dnscache", "feedparser", "fetcher", "httppool", "pipeline",
+           "htmltmpl", "logging", "Planet", "Channel", "NewsItem")
 
 
 import os
 import md5
 import time
+import random
+import calendar
 import dbhash
 import re
+import Queue
+import pickle
+import urlparse
+import collections
+try:
+    import threading
+except:
+    threading = None
+try:
+    import multiprocessing
+except:
+    multiprocessing = None
 
 try: 
     from xml.sax.saxutils import escape
@@ -53,6 +71,83 @@ CACHE_DIRECTORY = "cache"
 # Default number of items to display from a new feed
 NEW_FEED_ITEMS = 10
 
+# Default number of feeds to fetch in parallel
+FETCH_THREADS = 1
+
+# Default engine to fetch feeds with ("urllib2" or "select")
+FETCH_ENGINE = "urllib2"
+
+# Default number of processes to parse feeds in, 0 to parse in-process
+PARSE_PROCESSES = 0
+
+# Default largest feed, in bytes, to download; 0 for no limit
+MAX_FEED_BYTES = 0
+
+# Whether to parse feeds while they're still downloading by default
+INCREMENTAL_PARSE = 0
+
+# Default number of consecutive known, unchanged entries after which the
+# rest of a feed is skipped; 0 to always process every entry
+STOP_AFTER_KNOWN = 0
+
+# Default number of entries to process from each feed, 0 for no limit
+MAX_ENTRIES = 0
+
+# Whether to fetch, parse and write feeds in overlapping stages by default
+PIPELINE = 0
+
+# Default number of seconds before a fetch times out
+FEED_TIMEOUT = 20
+
+# Whether to reuse HTTP connections between feeds by default
+KEEPALIVE = 0
+
+# Default number of seconds to cache DNS lookups for, 0 to not cache them
+DNS_TTL = 0
+
+# Whether to remember sanitized HTML between runs by default, and the
+# file in the cache directory it's saved to
+SANITIZE_MEMO = 0
+SANITIZE_MEMO_FILE = ".sanitize-memo"
+
+# Whether feedparser should sanitize embedded markup with sanitize.HTML(),
+# rather than its own sanitizer followed by ours, by default; see
+# sanitize_feed() for how the results differ
+SINGLE_PASS_SANITIZE = 0
+
+# Default number of processes to sanitize feeds' HTML in, 0 to sanitize it
+# in-process, and the fewest values from one feed worth sending to them
+SANITIZE_PROCESSES = 0
+SANITIZE_MIN_BATCH = 50
+
+# Default bounds, in seconds, on how often a feed is polled; the adaptive
+# poll scheduler is only used when a maximum interval is configured
+MIN_POLL_INTERVAL = 1800
+MAX_POLL_INTERVAL = 0
+
+# Number of recent items used to work out how often a feed posts
+POLL_HISTORY = 10
+
+# Longest time, in seconds, a response is treated as fresh for
+MAX_CACHE_LIFETIME = 86400
+
+# Default number of seconds the update phase may take, 0 for no limit
+RUN_DEADLINE = 0
+
+# Initial and longest delays, in seconds, before retrying a failing feed
+BACKOFF_BASE = 600
+BACKOFF_MAX = 86400
+
+# Number of titles to remember the plain text of
+PLAIN_TEXT_MEMO_SIZE = 10000
+
+# Module globals which Planet.run() sets from the configuration for the
+# length of an update
+MODULE_SETTINGS = [ (feedparser, "FAST_XML_PARSER"),
+                    (feedparser, "FeedParserDict"),
+                    (feedparser, "HTML_SANITIZER"),
+                    (sanitize, "ENGINE") ]
+
 # Useful common date/time formats
 TIMEFMT_ISO = "%Y-%m-%dT%H:%M:%S+00:00"
 TIMEFMT_822 = "%a, %d %b %Y %H:%M:%S +0000"
@@ -84,6 +179,122 @@ class stripHtml(sgmllib.SGMLParser):
     def handle_data(self, data):
         if data: self.result+=data
 
+_plain_text_memo = {}
+_plain_text_order = collections.deque()
+_commentclose = re.compile(r'--\s*>')
+
+class _NotStripped(Exception):
+    pass
+
+def plain_text(data):
+    """Return the text of some HTML, with the tags removed.
+
+    This gives the same result as stripHtml(data).result, but finds the
+    tags with sgmllib's regular expressions in a single loop, and
+    remembers the results for the last PLAIN_TEXT_MEMO_SIZE values it
+    stripped, forgetting the oldest first.
+    """
+    try:
+        return _plain_text_memo[data]
+    except KeyError:
+        pass
+
+    try:
+        text = _strip_html(data)
+    except _NotStripped:
+        text = stripHtml(data).result
+
+    while _plain_text_order and \
+              len(_plain_text_memo) >= PLAIN_TEXT_MEMO_SIZE:
+        _plain_text_memo.pop(_plain_text_order.popleft(), None)
+    _plain_text_memo[data] = text
+    _plain_text_order.append(data)
+    return text
+
+def _strip_html(data):
+    """Strip the tags from a string as stripHtml does.
+
+    Declarations, SGML short tags and Unicode strings raise _NotStripped,
+    so that stripHtml is used instead.
+    """
+    if type(data) != type(''):
+        raise _NotStripped
+
+    pieces = []
+    append = pieces.append
+    i = 0
+    n = len(data)
+    while i < n:
+        match = sgmllib.interesting.search(data, i)
+        if match:
+            j = match.start()
+        else:
+            j = n
+        if i < j:
+            append(data[i:j])
+            i = j
+            if i == n:
+                break
+
+        if data[i] == '&':
+            match = sgmllib.charref.match(data, i)
+            if match:
+                try:
+                    code = int(match.group(1))
+                except ValueError:
+                    code = -1
+                if 0 <= code <= 127:
+                    append(chr(code))
+            else:
+                match = sgmllib.entityref.match(data, i)
+                if match:
+                    append(sgmllib.SGMLParser.entitydefs.get(match.group(1),
+                                                             ""))
+            if match:
+                i = match.end()
+                if data[i-1] != ';':
+                    i = i - 1
+                continue
+            j = sgmllib.incomplete.match(data, i).end()
+            if j == n:
+                break
+            append(data[i:j])
+            i = j
+            continue
+
+        c = data[i+1:i+2]
+        if c == '>' or c == '!' and not data.startswith('<!--', i):
+            raise _NotStripped
+        elif sgmllib.starttagopen.match(data, i) or c == '/':
+            if sgmllib.shorttagopen.match(data, i):
+                raise _NotStripped
+            match = sgmllib.endbracket.search(data, i+1)
+            if not match:
+                break
+            i = match.start()
+            if data[i] == '>':
+                i = i + 1
+        elif c == '!':
+            match = _commentclose.search(data, i+4)
+            if not match:
+                break
+            i = match.end()
+        elif c == '?':
+            j = data.find('>', i+2)
+            if j < 0:
+                break
+            i = j + 1
+        else:
+            # a '<' on its own is data
+            if i + 1 == n:
+                break
+            append('<')
+            i = i + 1
+
+    # Anything unfinished at the end is data too
+    append(data[i:])
+    return ''.join(pieces)
+
 def template_info(item, date_format):
     """Produce a dictionary of template information."""
     info = {}
@@ -95,9 +306,200 @@ def template_info(item, date_format):
             info[key + "_822"] = time.strftime(TIMEFMT_822, date)
         else:
             info[key] = item[key]
-    if 'title' in item.keys():
-        info['title_plain'] = stripHtml(info['title']).result
+    if 'title' in item.keys() and not 'title_plain' in item.keys():
+        info['title_plain'] = plain_text(info['title'])
+
+    return info
+
+def sanitize_feed(info, pool=None, min_batch=SANITIZE_MIN_BATCH):
+    """Make the text of a parsed feed safe to store.
+
+    Text constructs declared as text/html are cleaned with sanitize.HTML()
+    and those declared as text/plain are escaped; other text is left as
+    it is.  Values which can't be sanitized are logged and dropped.
+
+    With single_pass_sanitize feedparser has already cleaned the text/html
+    with sanitize.HTML(), so it's only encoded as sanitize.HTML() would
+    have returned it.  That cleans the feed's own markup rather than
+    feedparser's cleaned copy of it, so the fields can differ from two
+    passes: the text inside <style> elements is dropped rather than kept;
+    the tags after a <script>, <style> or <applet> which is never closed
+    are dropped too; whitespace at the end of markup which leaves elements
+    open is kept inside them; and markup so broken that feedparser's
+    output parses differently, such as "<<?pi?>", can come out
+    differently.  Each field's _detail holds the cleaned value too, rather
+    than feedparser's.
+
+    If pool is given, a multiprocessing.Pool, and the feed has at least
+    min_batch text/html values, they're cleaned in its processes.
+    """
+    html = feedparser.HTML_SANITIZER is not sanitize.HTML
+    if html and pool is not None:
+        batch = []
+    else:
+        batch = None
+    _sanitize_fields(info.feed, info.get("href", ""), html, batch)
+    for entry in info.entries:
+        _sanitize_fields(entry, entry.get("id") or entry.get("link") or "",
+                         html, batch)
+        if entry.has_key("content"):
+            for item in entry.content:
+                if item.type == 'text/html':
+                    if batch is not None:
+                        batch.append((item, "value", None))
+                    elif html:
+                        item.value = sanitize.HTML(item.value)
+                    elif isinstance(item.value, unicode):
+                        item.value = item.value.encode('utf8')
+                elif item.type == 'text/plain':
+                    item.value = escape(item.value)
+
+    if batch:
+        if len(batch) >= min_batch:
+            values = sanitize.HTMLList([ data[key] for data, key, name
+                                         in batch ], pool)
+        else:
+            values = [ None ] * len(batch)
+
+        # Values the pool couldn't clean are cleaned here, failing or
+        # being dropped as they would have been
+        for (data, key, name), value in zip(batch, values):
+            if value is not None:
+                data[key] = value
+            elif name is None:
+                data[key] = sanitize.HTML(data[key])
+            else:
+                try:
+                    data[key] = sanitize.HTML(data[key])
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    log.exception("Ignored '%s' of <%s>, unknown format",
+                                  key, name)
+                    del(data[key])
+
+def _sanitize_fields(data, name, html=1, batch=None):
+    """Sanitize the string fields of a feed or entry in place.
 
+    If batch is given, a list, text/html fields are added to it to be
+    cleaned later rather than cleaned now.
+    """
+    for key in data.keys():
+        if not isinstance(data[key], (str, unicode)):
+            continue
+        detail = key + '_detail'
+        if not data.has_key(detail) or not data[detail].has_key('type'):
+            continue
+        try:
+            if data[detail].type == 'text/html':
+                if batch is not None:
+                    batch.append((data, key, name))
+                elif html:
+                    data[key] = sanitize.HTML(data[key])
+                elif isinstance(data[key], unicode):
+                    # as sanitize.HTML() would have returned it
+                    data[key] = data[key].encode('utf8')
+            elif data[detail].type == 'text/plain':
+                data[key] = escape(data[key])
+        except KeyboardInterrupt:
+            raise
+        except:
+            log.exception("Ignored '%s' of <%s>, unknown format", key, name)
+            del(data[key])
+
+def parse_feed(resource, etag=None, modified=None, agent=None, stop=None,
+               hints=None, pool=None, min_batch=SANITIZE_MIN_BATCH):
+    """Parse and sanitize a feed.
+
+    This is the CPU-bound half of updating a channel.  It doesn't touch
+    any channel or cache state, so it can be run in a worker process.
+
+    If stop is given, an _EntryLimit, parsing stops once it's parsed as
+    many entries as are needed and info.truncated is set.  When it stopped
+    at known entries those are dropped rather than sanitized again, and
+    info.stopped_at_known is set to their ids.
+
+    Hints from the last parse of the feed, as returned by
+    Channel.parse_hints(), let feedparser skip the encodings and parser
+    which it found don't work for it.
+
+    pool and min_batch are passed on to sanitize_feed(); a pool can't be
+    used from a parse_processes worker.
+    """
+    info = feedparser.parse(resource, etag=etag, modified=modified,
+                            agent=agent, stop=stop, hints=hints)
+    if info.get("truncated") and stop.known_run(info.entries):
+        known = info.entries[-stop.known_limit:]
+        del info.entries[-stop.known_limit:]
+        info["stopped_at_known"] = [ cache.utf8(entry.has_key("id") and
+                                                entry.id or entry.link)
+                                     for entry in known ]
+    sanitize_feed(info, pool, min_batch)
+    return info
+
+class _EntryLimit:
+    """Tells feedparser when it has parsed all the entries it needs.
+
+    Called with a list of entries and the number of them parsed so far,
+    it's true once there are max_entries of them, or once the last
+    known_limit of them are all cached items with the same updated date.
+    Entries with neither an id nor a link, or without an updated date,
+    are never counted as known.
+
+    Properties:
+        max_entries     Number of entries to stop at, 0 for no limit.
+        known           Updated date of each cached item, by id.
+        known_limit     Number of consecutive known entries to stop at,
+                        0 to not stop at known entries.
+    """
+    def __init__(self, max_entries=0, known=None, known_limit=0):
+        self.max_entries = max_entries
+        self.known = known or {}
+        self.known_limit = known_limit
+
+    def __call__(self, entries, count):
+        if self.max_entries and count >= self.max_entries:
+            return 1
+        return self.known_run(entries, count)
+
+    def known_run(self, entries, count=None):
+        """Check whether the last entries parsed are known and unchanged.
+
+        Only the first count entries have been parsed, or all of them if
+        count isn't given.
+        """
+        if count is None:
+            count = len(entries)
+        if not self.known_limit or count < self.known_limit:
+            return 0
+        for i in range(count - self.known_limit, count):
+            entry = entries[i]
+            if entry.has_key("id"):
+                entry_id = cache.utf8(entry.id)
+            elif entry.has_key("link"):
+                entry_id = cache.utf8(entry.link)
+            else:
+                return 0
+            updated = entry.get("updated_parsed")
+            if updated is None or self.known.get(entry_id) != tuple(updated):
+                return 0
+        return 1
+
+def _parse_worker(resource, etag, modified, agent, stop, hints):
+    """Run parse_feed() in a parse_processes worker.
+
+    The result is pickled to send it back, which exceptions raised by
+    the XML parsers can't always be, so bozo_exception is replaced by
+    a plain Exception with the same message when necessary.
+    """
+    info = parse_feed(resource, etag, modified, agent, stop, hints)
+    e = info.get("bozo_exception")
+    if e is not None:
+        try:
+            pickle.dumps(e)
+        except:
+            info.bozo_exception = Exception("%s: %s"
+                                            % (e.__class__.__name__, e))
     return info
 
 
@@ -113,17 +515,61 @@ class Planet:
         new_feed_items  Number of items to display from a new feed.
         filter          A regular expression that articles must match.
         exclude         A regular expression that articles must not match.
+        fetch_threads   Number of feeds to fetch and parse in parallel.
+        parse_processes Number of worker processes to parse feeds in.
+        sanitize_processes
+                        Number of worker processes to sanitize the HTML
+                        of feeds parsed in-process in.
+        sanitize_min_batch
+                        Fewest HTML values from a feed worth sending to
+                        the sanitize_processes.
+        incremental_parse
+                        Parse feeds while they're still downloading.
+        pipeline        Fetch, parse and write feeds in overlapping stages.
+        pipeline_depth  Items allowed to wait between pipeline stages.
+        fetch_engine    Fetch with urllib2, or the non-blocking "select"
+                        engine in planet.fetcher.
+        fetch_connections
+                        Requests the "select" engine keeps in flight.
+        feed_timeout    Seconds before a fetch times out.
+        connection_pool Pool of persistent HTTP connections, if enabled.
+        resolver        Cache of DNS lookups, if enabled.
+        sanitize_memo   Memo of sanitized HTML, if enabled.
+        run_deadline    Seconds after which no more feeds are fetched.
     """
     def __init__(self, config):
         self.config = config
 
         self._channels = []
+        if threading:
+            self._cache_lock = threading.Lock()
+        else:
+            self._cache_lock = None
 
         self.user_agent = USER_AGENT
         self.cache_directory = CACHE_DIRECTORY
         self.new_feed_items = NEW_FEED_ITEMS
+        self.fetch_threads = FETCH_THREADS
+        self.parse_processes = PARSE_PROCESSES
+        self.sanitize_processes = SANITIZE_PROCESSES
+        self.sanitize_min_batch = SANITIZE_MIN_BATCH
+        self.incremental_parse = INCREMENTAL_PARSE
+        self.pipeline = PIPELINE
+        self.pipeline_depth = pipeline.DEPTH
+        self.fetch_engine = FETCH_ENGINE
+        self.fetch_connections = fetcher.MAX_ACTIVE
+        self.feed_timeout = FEED_TIMEOUT
+        self.connection_pool = None
+        self.resolver = None
+        self.sanitize_memo = None
+        self.run_deadline = RUN_DEADLINE
         self.filter = None
         self.exclude = None
+        self._deadline = None
+        self._parse_pool = None
+        self._sanitize_pool = None
+        self._parsing = []
+        self._unsynced = None
 
     def tmpl_config_get(self, template, option, default=None, raw=0, vars=None):
         """Get a template value from the configuration, with a default."""
@@ -177,6 +623,13 @@ class Planet:
             elif status >= 400:
                channels[channel]["message"] = "http status %s" % status
 
+            # report feeds we're backing off from
+            if status >= 400 and channel.backing_off():
+                channels[channel]["message"] += \
+                    ", %s failures, next retry %s" % (channel.url_failures,
+                    time.strftime(date_format,
+                                  channel.get_as_date("url_retry")))
+
         return channels, channels_list
 
     def gather_items_info(self, channels, template_file="Planet", channel_list=None):
@@ -217,8 +670,19 @@ class Planet:
 
         return items_list
 
-    def run(self, planet_name, planet_link, template_files, offline = False):
+    def run(self, planet_name, planet_link, template_files, offline = False,
+            force = False):
+        """Load the channels from the cache and update them.
+
+        Unless force is true, channels the poll scheduler says aren't yet
+        due are left with their cached information.
+
+        Channels are fetched most promising first, so that if run_deadline
+        is reached the ones left with their cached information are those
+        least likely to have changed.
+        """
         log = logging.getLogger("planet.runner")
+        start = time.time()
 
         # Create a planet
         log.info("Loading cached data")
@@ -230,8 +694,53 @@ class Planet:
                                               self.user_agent)
         if self.config.has_option("Planet", "filter"):
             self.filter = self.config.get("Planet", "filter")
+        if self.config.has_option("Planet", "fetch_threads"):
+            self.fetch_threads = int(self.config.get("Planet", "fetch_threads"))
+        if self.config.has_option("Planet", "parse_processes"):
+            self.parse_processes = int(self.config.get("Planet",
+                                                       "parse_processes"))
+        if self.config.has_option("Planet", "sanitize_processes"):
+            self.sanitize_processes = int(self.config.get("Planet",
+                                                          "sanitize_processes"))
+        if self.config.has_option("Planet", "sanitize_min_batch"):
+            self.sanitize_min_batch = int(self.config.get("Planet",
+                                                          "sanitize_min_batch"))
+        if self.config.has_option("Planet", "incremental_parse"):
+            self.incremental_parse = int(self.config.get("Planet",
+                                                         "incremental_parse"))
+        if self.config.has_option("Planet", "pipeline"):
+            self.pipeline = int(self.config.get("Planet", "pipeline"))
+        if self.config.has_option("Planet", "pipeline_depth"):
+            self.pipeline_depth = int(self.config.get("Planet",
+                                                      "pipeline_depth"))
+        if self.config.has_option("Planet", "fetch_engine"):
+            self.fetch_engine = self.config.get("Planet", "fetch_engine")
+        if self.config.has_option("Planet", "fetch_connections"):
+            self.fetch_connections = int(self.config.get("Planet",
+                                                         "fetch_connections"))
+        if self.config.has_option("Planet", "feed_timeout"):
+            try:
+                self.feed_timeout = float(self.config.get("Planet",
+                                                          "feed_timeout"))
+            except ValueError:
+                pass
+        if self.config.has_option("Planet", "run_deadline"):
+            self.run_deadline = int(self.config.get("Planet", "run_deadline"))
+        if self.run_deadline:
+            self._deadline = start + self.run_deadline
+        if int(self.tmpl_config_get("Planet", "keepalive", KEEPALIVE)):
+            self.connection_pool = httppool.ConnectionPool(
+                int(self.tmpl_config_get("Planet", "keepalive_idle",
+                                         httppool.MAX_IDLE)),
+                int(self.tmpl_config_get("Planet", "keepalive_requests",
+                                         httppool.MAX_REQUESTS)))
 
         # The other configuration blocks are channels to subscribe to
+        update = []
+        fresh = 0
+        failing = 0
+        not_due = 0
+        now = time.time()
         for feed_url in self.config.sections():
             if feed_url == "Planet" or feed_url in template_files:
                 continue
@@ -240,14 +749,385 @@ class Planet:
             channel = Channel(self, feed_url)
             self.subscribe(channel)
 
-            # Update it
+            if offline or channel.url_status == '410':
+                continue
+            elif not force and channel.fresh(now):
+                fresh += 1
+                continue
+            elif not force and channel.backing_off(now):
+                failing += 1
+                continue
+            elif not force and not channel.due(now):
+                not_due += 1
+                continue
+            update.append(channel)
+
+        if fresh:
+            log.info("Skipping %d feeds still fresh", fresh)
+        if failing:
+            log.info("Skipping %d failing feeds until they're retried", failing)
+        if not_due:
+            log.info("Skipping %d feeds not yet due", not_due)
+
+        # Update them, most promising first
+        update = [ (c.priority(), i, c) for i, c in enumerate(update) ]
+        update.sort()
+        update = [ u[-1] for u in update ]
+
+        dns_ttl = int(self.tmpl_config_get("Planet", "dns_ttl", DNS_TTL))
+        if dns_ttl > 0 and update:
+            self.resolver = dnscache.Resolver(dns_ttl,
+                int(self.tmpl_config_get("Planet", "dns_negative_ttl",
+                                         dnscache.NEGATIVE_TTL)))
+            self.resolver.install()
+
+        # Settings kept in module globals are put back once the update is
+        # over, so they don't carry over to anything else in the process
+        settings = [ (module, name, getattr(module, name))
+                     for module, name in MODULE_SETTINGS ]
+        try:
+            if self.config.has_option("Planet", "fast_xml_parser"):
+                feedparser.FAST_XML_PARSER = int(self.config.get("Planet",
+                                                 "fast_xml_parser"))
+            if self.config.has_option("Planet", "dict_feedparserdict"):
+                feedparser.useDictFeedParserDict(int(self.config.get("Planet",
+                                                     "dict_feedparserdict")))
+            if int(self.tmpl_config_get("Planet", "single_pass_sanitize",
+                                        SINGLE_PASS_SANITIZE)):
+                feedparser.HTML_SANITIZER = sanitize.HTML
+            if self.config.has_option("Planet", "sanitize_engine"):
+                engine = self.config.get("Planet", "sanitize_engine")
+                if engine in ("sgmllib", "regex"):
+                    sanitize.ENGINE = engine
+                else:
+                    log.warning("Unknown sanitize engine '%s', skipping",
+                                engine)
+            if int(self.tmpl_config_get("Planet", "sanitize_memo",
+                                        SANITIZE_MEMO)):
+                self.sanitize_memo = sanitize.Memo(
+                    int(self.tmpl_config_get("Planet", "sanitize_memo_size",
+                                             sanitize.MEMO_SIZE)))
+                self.sanitize_memo.load(os.path.join(self.cache_directory,
+                                                     SANITIZE_MEMO_FILE))
+                self.sanitize_memo.install()
+
+            if self.parse_processes > 0 and multiprocessing and \
+                   len(update) > 1:
+                log.debug("Parsing feeds in %d processes",
+                          self.parse_processes)
+                self._parse_pool = multiprocessing.Pool(self.parse_processes)
+            if self.sanitize_processes > 0 and multiprocessing and update:
+                log.debug("Sanitizing feeds in %d processes",
+                          self.sanitize_processes)
+                self._sanitize_pool = multiprocessing.Pool(
+                    self.sanitize_processes)
+
+            started = time.time()
+            if self.pipeline and threading and len(update) > 1:
+                skipped = self.update_pipelined(update)
+            elif self.fetch_engine == "select" and len(update) > 1:
+                skipped = self.update_select(update)
+            elif self.fetch_threads > 1 and threading and len(update) > 1:
+                skipped = self.update_threaded(update)
+            else:
+                skipped = 0
+                for channel in update:
+                    if self.deadline_passed():
+                        skipped += 1
+                        continue
+                    self.update_channel(channel)
+            if skipped:
+                log.warning("Run deadline reached, %d feeds left with cached "
+                            "data", skipped)
+
+            if self._parse_pool:
+                self._parse_pool.close()
+                self.finish_parsing()
+                self._parse_pool.join()
+                self._parse_pool = None
+
+            if self._sanitize_pool:
+                self._sanitize_pool.close()
+                self._sanitize_pool.join()
+                self._sanitize_pool = None
+        finally:
+            self.terminate_pools()
+            if self.resolver:
+                self.resolver.uninstall()
+            if self.sanitize_memo:
+                self.sanitize_memo.uninstall()
+            for module, name, value in settings:
+                setattr(module, name, value)
+
+        if self.connection_pool:
+            log.debug("Connection pool: %d hits, %d misses",
+                      self.connection_pool.hits, self.connection_pool.misses)
+            self.connection_pool.close()
+
+        if self.resolver:
+            log.info("DNS cache: %d hits, %d misses, %.2fs resolving "
+                     "in %.2fs updating", self.resolver.hits,
+                     self.resolver.misses, self.resolver.resolve_time,
+                     time.time() - started)
+
+        if self.sanitize_memo:
+            log.info("Sanitize memo: %d hits, %d misses, %.1f%% hit rate",
+                     self.sanitize_memo.hits, self.sanitize_memo.misses,
+                     self.sanitize_memo.hit_rate())
+            try:
+                self.sanitize_memo.save(os.path.join(self.cache_directory,
+                                                     SANITIZE_MEMO_FILE))
+            except (IOError, OSError), e:
+                log.warning("Unable to save sanitize memo: %s", e)
+
+    def terminate_pools(self):
+        """Stop any worker processes left running by an unfinished update.
+
+        Feeds still waiting on the parse processes are left with their
+        cached information.
+        """
+        self._parsing = []
+        for pool in (self._parse_pool, self._sanitize_pool):
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self._parse_pool = None
+        self._sanitize_pool = None
+
+    def sanitize_options(self):
+        """Return the options for sanitizing a feed parsed in-process."""
+        return { "pool": self._sanitize_pool,
+                 "min_batch": self.sanitize_min_batch }
+
+    def deadline_passed(self):
+        """Check whether the run deadline, if any, has been reached."""
+        return self._deadline is not None and time.time() >= self._deadline
+
+    def update_channel(self, channel, resource=None):
+        """Update a single channel, logging rather than raising errors.
+
+        When parse_processes is set the feed is only fetched here, and
+        the update is finished by finish_parsing() once a worker process
+        has parsed it.
+        """
+        log = logging.getLogger("planet.runner")
+        try:
+            finish = channel.update(resource, self._parse_pool)
+            if finish is not None:
+                self._parsing.append((channel, finish))
+        except KeyboardInterrupt:
+            raise
+        except:
+            log.exception("Update of <%s> failed", channel.configured_url)
+
+    def finish_parsing(self):
+        """Finish updating the channels waiting on the parse processes.
+
+        Results are collected in the order the feeds were fetched, so the
+        cache is written just as it would be when parsing in-process.
+        """
+        log = logging.getLogger("planet.runner")
+        parsing = self._parsing
+        self._parsing = []
+        for channel, finish in parsing:
             try:
-                if not offline and not channel.url_status == '410':
-                    channel.update()
+                finish()
             except KeyboardInterrupt:
                 raise
             except:
-                log.exception("Update of <%s> failed", feed_url)
+                log.exception("Update of <%s> failed", channel.configured_url)
+
+    def update_threaded(self, channels):
+        """Update the channels using a pool of fetch_threads threads.
+
+        Each channel is only ever touched by the one thread that picked it
+        off the queue, and writes to the cache files are serialised through
+        the planet's cache lock, so the end result is the same as updating
+        the channels one after the other.
+
+        Returns the number of channels not updated because the run
+        deadline was reached.
+        """
+        log = logging.getLogger("planet.runner")
+        queue = Queue.Queue()
+        for channel in channels:
+            queue.put(channel)
+
+        def worker():
+            while not self.deadline_passed():
+                try:
+                    channel = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                self.update_channel(channel)
+
+        threads = []
+        for i in range(min(self.fetch_threads, len(channels))):
+            thread = threading.Thread(target=worker, name="fetch-%d" % i)
+            thread.setDaemon(1)
+            thread.start()
+            threads.append(thread)
+        log.debug("Updating %d feeds with %d threads",
+                  len(channels), len(threads))
+
+        # Join with a timeout so that KeyboardInterrupt still gets through
+        for thread in threads:
+            while thread.isAlive():
+                thread.join(1)
+
+        return queue.qsize()
+
+    def update_select(self, channels, handle=None):
+        """Update the channels using the non-blocking fetcher.
+
+        All of the HTTP feeds are fetched from this one thread with up to
+        fetch_connections requests in flight, each channel being updated
+        from its response as soon as that arrives.  Feeds with other URL
+        schemes, or which redirect to one, are fetched the usual way in
+        threads of the fetcher's while it runs.
+
+        Each channel and its response are passed to handle, which defaults
+        to update_channel().
+
+        Returns the number of channels not updated because the run
+        deadline was reached.
+        """
+        if handle is None:
+            handle = self.update_channel
+        log = logging.getLogger("planet.runner")
+        engine = fetcher.Fetcher(self.feed_timeout, self.fetch_connections,
+                                 self.user_agent, self.incremental_parse)
+        for channel in channels:
+            def callback(response, channel=channel, handle=handle):
+                handle(channel, response)
+            engine.add(channel.url, callback,
+                       etag=channel.url_etag, modified=channel.url_modified,
+                       max_bytes=channel.size_limit(), fallback=channel.fetch)
+
+        log.debug("Fetching feeds with up to %d connections",
+                  self.fetch_connections)
+        return engine.run(self._deadline)
+
+    def update_pipelined(self, channels):
+        """Update the channels through a pipeline of threaded stages.
+
+        Channels are fetched by the fetch stage, using fetch_threads threads
+        or the "select" engine, then parsed by the parse stage, in one
+        thread or in each of the parse_processes, and finally updated and
+        written to the cache by a single write stage.  Up to pipeline_depth
+        channels may wait between each stage.
+
+        Syncing the cache files is deferred by the write stage until it
+        runs out of work or has pipeline_depth unsynced channels.
+
+        Returns the number of channels not updated because the run
+        deadline was reached.
+        """
+        log = logging.getLogger("planet.runner")
+        skipped = []
+
+        def error(item):
+            if isinstance(item, list):
+                log.exception("Fetch of %d feeds failed", len(item))
+                return
+            elif isinstance(item, Channel):
+                channel = item
+            else:
+                channel = item[0]
+            log.exception("Update of <%s> failed", channel.configured_url)
+
+        def write(item, put):
+            channel, update, args = item
+            try:
+                update(*args)
+            finally:
+                if write_stage.empty() or \
+                       len(self._unsynced) >= self.pipeline_depth:
+                    self.sync_caches()
+
+        def parse(item, put):
+            channel, resource = item
+            digest = channel.digest(resource)
+            if channel.unchanged(resource, digest):
+                put((channel, channel.update_unchanged, (resource,)))
+                return
+
+            args = (resource, channel.url_etag, channel.url_modified,
+                    self.user_agent, channel.entry_limit(),
+                    channel.parse_hints())
+            if self._parse_pool is not None and digest is not None and \
+                   resource.error is None:
+                info = self._parse_pool.apply(_parse_worker, args)
+            else:
+                info = parse_feed(*args, **self.sanitize_options())
+            put((channel, channel.update_parsed, (info, digest)))
+
+        if self.fetch_engine == "select":
+            def fetch(channels, put):
+                # The fetcher mustn't wait for room in the parse stage, so
+                # responses are buffered and handed on by another thread
+                fetched = Queue.Queue()
+                def hand_on():
+                    while 1:
+                        item = fetched.get()
+                        if item is None:
+                            return
+                        put(item)
+                thread = threading.Thread(target=hand_on, name="fetch-hand-on")
+                thread.setDaemon(1)
+                thread.start()
+                try:
+                    skipped.extend([None] * self.update_select(channels,
+                        lambda channel, resource: fetched.put((channel,
+                                                               resource))))
+                finally:
+                    fetched.put(None)
+                    while thread.isAlive():
+                        thread.join(1)
+            work = [ channels ]
+            threads = 1
+        else:
+            def fetch(channel, put):
+                if self.deadline_passed():
+                    skipped.append(channel)
+                else:
+                    put((channel, channel.fetch()))
+            work = channels
+            threads = min(self.fetch_threads, len(channels))
+
+        write_stage = pipeline.Stage("write", write, None, 1,
+                                     self.pipeline_depth, error)
+        parse_stage = pipeline.Stage("parse", parse, write_stage,
+                                     max(1, self.parse_processes),
+                                     self.pipeline_depth, error)
+        fetch_stage = pipeline.Stage("fetch", fetch, parse_stage, threads,
+                                     self.pipeline_depth, error)
+        stages = (fetch_stage, parse_stage, write_stage)
+
+        self._unsynced = {}
+        try:
+            for stage in stages:
+                stage.start()
+            for item in work:
+                fetch_stage.put(item)
+            for stage in stages:
+                stage.close()
+        finally:
+            self.sync_caches()
+            self._unsynced = None
+
+        for stage in stages:
+            log.info("Stage %s", stage.report())
+        return len(skipped)
+
+    def sync_caches(self):
+        """Sync the cache files of channels written by the pipeline."""
+        if not self._unsynced:
+            return
+        unsynced = self._unsynced.values()
+        self._unsynced.clear()
+        for channel in unsynced:
+            channel.cache_sync()
 
     def generate_all_files(self, template_files, planet_name,
                 planet_link, planet_feed, owner_name, owner_email):
@@ -455,7 +1335,20 @@ class Channel(cache.CachedInfo):
         url             URL of the feed.
         url_etag        E-Tag of the feed URL.
         url_modified    Last modified time of the feed URL.
+        url_digest      MD5 digest of the last feed body processed.
+        url_encoding    Character encoding the feed was last parsed in.
+        url_declared    Encodings the feed declared when it was.
+        url_strict      Whether the strict XML parser managed the feed.
+        url_strict_skipped
+                        Number of parses since the strict XML parser was
+                        last tried on the feed.
         url_status      Last HTTP status of the feed URL.
+        url_expires     Time the last response stops being fresh.
+        url_not_modified
+                        Number of consecutive polls answered with a 304.
+        url_failures    Number of consecutive polls that failed.
+        url_retry       Time before which a failing feed isn't polled.
+        next_due        Time the poll scheduler next wants the feed fetched.
         hidden          Channel should be hidden (True if exists).
         name            Name of the feed owner, or feed title.
         next_order      Next order number to be assigned to NewsItem
@@ -517,6 +1410,16 @@ class Channel(cache.CachedInfo):
         self.url_etag = None
         self.url_status = None
         self.url_modified = None
+        self.url_digest = None
+        self.url_encoding = None
+        self.url_declared = None
+        self.url_strict = None
+        self.url_strict_skipped = None
+        self.url_expires = None
+        self.url_not_modified = "0"
+        self.url_failures = "0"
+        self.url_retry = None
+        self.next_due = None
         self.name = None
         self.updated = None
         self.last_updated = None
@@ -530,6 +1433,9 @@ class Channel(cache.CachedInfo):
             for option in planet.config.options(url):
                 value = planet.config.get(url, option)
                 self.set_as_string(option, value, cached=0)
+            if planet.config.has_option(url, "title"):
+                self.set_as_string("title_plain", plain_text(self.title),
+                                   cached=0)
 
     def has_item(self, id_):
         """Check whether the item exists in the channel."""
@@ -572,15 +1478,175 @@ class Channel(cache.CachedInfo):
     def cache_basename(self):
         return cache.filename('',self._id)
 
-    def cache_write(self, sync=1):
-        """Write channel and item information to the cache."""
-        for item in self._items.values():
-            item.cache_write(sync=0)
-        for item in self._expired:
-            item.cache_clear(sync=0)
-        cache.CachedInfo.cache_write(self, sync)
+    def cache_write(self, sync=1, items=1):
+        """Write channel and item information to the cache.
 
-        self._expired = []
+        If items is false only the channel information is written.
+        """
+        lock = self._planet._cache_lock
+        if lock: lock.acquire()
+        try:
+            if items:
+                for item in self._items.values():
+                    item.cache_write(sync=0)
+                for item in self._expired:
+                    item.cache_clear(sync=0)
+                self._expired = []
+            if sync and self._planet._unsynced is not None:
+                # Batched by the pipeline's write stage
+                self._planet._unsynced[id(self)] = self
+                sync = 0
+            cache.CachedInfo.cache_write(self, sync)
+        finally:
+            if lock: lock.release()
+
+    def cache_sync(self):
+        """Flush written information to the cache file."""
+        lock = self._planet._cache_lock
+        if lock: lock.acquire()
+        try:
+            self._cache.sync()
+        finally:
+            if lock: lock.release()
+
+    def fresh(self, now=None):
+        """Check whether the last response we got is still fresh."""
+        if not self.has_key("url_expires") or \
+               self.key_type("url_expires") != self.DATE:
+            return 0
+        if now is None:
+            now = time.time()
+        return calendar.timegm(self.get_as_date("url_expires")) > now
+
+    def update_expires(self, status, headers):
+        """Record how long the response just received stays fresh.
+
+        Cache-Control max-age and Expires are honoured for successful
+        responses, Retry-After for 429 and 503 responses; either way the
+        lifetime is capped by max_cache_lifetime.
+        """
+        now = time.time()
+        if status in (429, 503):
+            lifetime = fetcher.retry_after(headers, now)
+        elif status < 400:
+            lifetime = fetcher.freshness(headers, now)
+        else:
+            lifetime = None
+
+        if lifetime:
+            lifetime = min(lifetime,
+                           int(self._planet.tmpl_config_get(self.configured_url,
+                                                            "max_cache_lifetime",
+                                                            MAX_CACHE_LIFETIME)))
+            self.set_as_date("url_expires", time.gmtime(now + lifetime))
+            log.debug("Feed %s fresh for %d seconds",
+                      self.feed_information(), lifetime)
+        else:
+            self.url_expires = None
+
+    def backing_off(self, now=None):
+        """Check whether we're waiting before retrying a failing feed."""
+        if not self.has_key("url_retry") or \
+               self.key_type("url_retry") != self.DATE:
+            return 0
+        if now is None:
+            now = time.time()
+        return calendar.timegm(self.get_as_date("url_retry")) > now
+
+    def failed(self):
+        """Record a failed poll and work out when to retry the feed.
+
+        The delay doubles with each consecutive failure, from backoff_base
+        up to backoff_max seconds, and is randomly shortened by up to half
+        so that feeds which failed together aren't all retried together.
+        """
+        failures = int(self.url_failures) + 1
+        self.url_failures = str(failures)
+
+        planet = self._planet
+        base = int(planet.tmpl_config_get(self.configured_url,
+                                          "backoff_base", BACKOFF_BASE))
+        cap = int(planet.tmpl_config_get(self.configured_url,
+                                         "backoff_max", BACKOFF_MAX))
+        delay = min(cap, base * 2 ** min(failures - 1, 30))
+        delay = random.uniform(delay / 2.0, delay)
+
+        self.set_as_date("url_retry", time.gmtime(time.time() + delay))
+        log.debug("Feed %s failed %d times, retrying in %d seconds",
+                  self.feed_information(), failures, delay)
+        self.cache_write(items=0)
+
+    def succeeded(self):
+        """Record a successful poll, resetting any backoff."""
+        self.url_failures = "0"
+        self.url_retry = None
+
+    def priority(self):
+        """Return a key to sort channels by, most worth fetching first.
+
+        Channels which keep answering 304 come last, otherwise channels
+        are ordered by how recently they last posted; channels we know
+        nothing about yet come first.
+        """
+        items = self.items(hidden=1, sorted=1)
+        if items:
+            newest = calendar.timegm(items[0].date)
+        else:
+            newest = time.time()
+        return (int(self.url_not_modified), -newest)
+
+    def poll_intervals(self):
+        """Return the minimum and maximum poll intervals for the feed."""
+        planet = self._planet
+        return (int(planet.tmpl_config_get(self.configured_url,
+                                           "min_poll_interval",
+                                           MIN_POLL_INTERVAL)),
+                int(planet.tmpl_config_get(self.configured_url,
+                                           "max_poll_interval",
+                                           MAX_POLL_INTERVAL)))
+
+    def due(self, now=None):
+        """Check whether the poll scheduler wants the feed fetched."""
+        min_interval, max_interval = self.poll_intervals()
+        if not max_interval:
+            return 1
+        if not self.has_key("next_due") or self.key_type("next_due") != self.DATE:
+            return 1
+        if now is None:
+            now = time.time()
+        return calendar.timegm(self.get_as_date("next_due")) <= now
+
+    def schedule(self, headers=None):
+        """Work out when the feed should next be polled.
+
+        The interval is half the time between the recent items in the
+        feed, or half the time since the newest one if that is longer;
+        it's stretched by each consecutive poll answered with a 304,
+        and not shorter than the freshness lifetime the server gave.
+        The result is bounded by the feed's poll intervals.
+        """
+        min_interval, max_interval = self.poll_intervals()
+        if not max_interval:
+            return
+
+        now = time.time()
+        dates = [ calendar.timegm(item.date)
+                  for item in self.items(hidden=1, sorted=1)[:POLL_HISTORY] ]
+        if len(dates) > 1:
+            interval = max((dates[0] - dates[-1]) / (len(dates) - 1),
+                           now - dates[0]) / 2
+        else:
+            interval = max_interval
+
+        interval *= 1 + 0.5 * int(self.url_not_modified)
+        lifetime = fetcher.freshness(headers, now)
+        if lifetime:
+            interval = max(interval, lifetime)
+        interval = max(min_interval, min(interval, max_interval))
+
+        self.set_as_date("next_due", time.gmtime(now + interval))
+        log.debug("Next poll of %s due in %d seconds",
+                  self.feed_information(), interval)
 
     def feed_information(self):
         """
@@ -598,26 +1664,194 @@ class Channel(cache.CachedInfo):
         else:
             return "<%s> (formerly <%s>)" % (self.url, self.configured_url)
 
-    def update(self):
+    def size_limit(self):
+        """Return the largest feed, in bytes, to download for the channel."""
+        return int(self._planet.tmpl_config_get(self.configured_url,
+                                                "max_feed_bytes",
+                                                MAX_FEED_BYTES))
+
+    def fetch(self):
+        """Download the feed.
+
+        Returns a planet.fetcher.Response holding the complete response
+        for URLs feedparser would fetch itself, otherwise just the URL.
+
+        The body is read a piece at a time and decompressed as it arrives,
+        and the download is abandoned as soon as the feed turns out to be
+        larger than max_feed_bytes.  With incremental_parse each piece is
+        also parsed as it arrives.
+        """
+        if urlparse.urlparse(self.url)[0] not in ("http", "https", "ftp"):
+            return self.url
+
+        resolver = self._planet.resolver
+        if resolver:
+            start = time.time()
+            resolving = resolver.thread_time()
+
+        max_bytes = self.size_limit()
+        handlers = []
+        if self._planet.connection_pool:
+            handlers.append(httppool.KeepAliveHandler(
+                self._planet.connection_pool, max_bytes))
+        f = None
+        try:
+            f = feedparser._open_resource(self.url, self.url_etag,
+                                          self.url_modified,
+                                          self._planet.user_agent, None,
+                                          handlers)
+            headers = getattr(f, "headers", None)
+            parser = None
+            if self._planet.incremental_parse and headers is not None and \
+                   getattr(f, "status", 200) in (200, 226, 301, 302, 307):
+                parser = feedparser._IncrementalParser(
+                    getattr(f, "url", self.url), headers.dict)
+            if headers is not None:
+                body = fetcher.Decoder(headers.get("content-encoding"),
+                                       max_bytes, parser)
+            else:
+                body = fetcher.Decoder(None, max_bytes)
+            while 1:
+                data = f.read(fetcher.READ_SIZE)
+                if not data:
+                    break
+                body.feed(data)
+            data = body.close()
+        except KeyboardInterrupt:
+            raise
+        except Exception, e:
+            if hasattr(f, "close"):
+                f.close()
+            return fetcher.Response(self.url, error=e)
+
+        if body.encoding:
+            del headers["content-encoding"]
+        response = fetcher.Response(getattr(f, "url", self.url),
+                                    getattr(f, "status", 200),
+                                    headers, data)
+        if parser is not None:
+            response.parsed = parser.result()
+        if hasattr(f, "close"):
+            f.close()
+        if resolver:
+            log.debug("Fetched <%s> in %.2fs, %.2fs of it resolving", self.url,
+                      time.time() - start, resolver.thread_time() - resolving)
+        return response
+
+    def update(self, resource=None, pool=None):
         """Download the feed to refresh the information.
 
         This does the actual work of pulling down the feed and if it changes
         updates the cached information about the feed and entries within it.
+
+        If resource is given it is used instead of downloading the feed;
+        it can be anything feedparser accepts, such as an already fetched
+        planet.fetcher.Response.
+
+        Some servers ignore conditional requests and send the same feed
+        again; when the body is byte-for-byte identical to the one we last
+        processed it's treated just like a 304 and not parsed at all.
+
+        If pool is given, a multiprocessing.Pool, a fetched feed is parsed
+        in one of its processes instead and a function is returned which
+        finishes the update once the result is ready.
+        """
+        if resource is None:
+            resource = self.fetch()
+
+        digest = self.digest(resource)
+        if self.unchanged(resource, digest):
+            self.update_unchanged(resource)
+            return
+
+        args = (resource, self.url_etag, self.url_modified,
+                self._planet.user_agent, self.entry_limit(),
+                self.parse_hints())
+        if pool is not None and digest is not None and resource.error is None:
+            result = pool.apply_async(_parse_worker, args)
+            return lambda: self.update_parsed(result.get(), digest)
+
+        self.update_parsed(parse_feed(*args,
+                                      **self._planet.sanitize_options()),
+                           digest)
+
+    def entry_limit(self):
+        """Return an _EntryLimit to stop parsing the feed with, if any.
+
+        Parsing stops after max_entries entries, if that's set for the
+        channel, or at stop_after_known known entries if that's set and
+        there are items in the cache to compare the feed's entries with.
         """
-        info = feedparser.parse(self.url,
-                                etag=self.url_etag, modified=self.url_modified,
-                                agent=self._planet.user_agent)
+        max_entries = int(self._planet.tmpl_config_get(self.configured_url,
+                                                       "max_entries",
+                                                       MAX_ENTRIES))
+        known_limit = int(self._planet.tmpl_config_get(self.configured_url,
+                                                       "stop_after_known",
+                                                       STOP_AFTER_KNOWN))
+        if known_limit <= 0 or not self._items:
+            known_limit = 0
+        if max_entries <= 0 and not known_limit:
+            return None
+
+        known = {}
+        if known_limit:
+            for item in self._items.values():
+                if item.has_key("updated") and \
+                       item.key_type("updated") == item.DATE:
+                    known[item.id] = item.get_as_date("updated")
+        return _EntryLimit(max(max_entries, 0), known, known_limit)
+
+    def parse_hints(self):
+        """Return the hints feedparser gave when it last parsed the feed."""
+        if self.url_declared is None or self.url_strict is None:
+            return None
+        return { "declared": self.url_declared,
+                 "encoding": self.url_encoding,
+                 "strict": int(self.url_strict),
+                 "skipped": int(self.url_strict_skipped or 0) }
+
+    def digest(self, resource):
+        """Return the MD5 digest of a fetched feed's body, if there is one."""
+        if isinstance(resource, fetcher.Response):
+            try:
+                return md5.new(resource.read()).hexdigest()
+            except KeyboardInterrupt:
+                raise
+            except:
+                pass
+        return None
+
+    def unchanged(self, resource, digest):
+        """Check whether a fetched feed is the one we last processed."""
+        return digest is not None and digest == self.url_digest and \
+               resource.status in (200, 226)
+
+    def update_unchanged(self, resource):
+        """Update the channel from a response unchanged() is true for."""
+        log.info("Feed %s unchanged (same content)", self.feed_information())
+        self.url_status = str(resource.status)
+        self.update_expires(resource.status, resource.headers.dict)
+        self.succeeded()
+        self.not_modified(resource.headers.dict)
+
+    def update_parsed(self, info, digest=None):
+        """Update the channel from the result of parse_feed()."""
         if info.has_key("status"):
            self.url_status = str(info.status)
-        elif info.has_key("entries") and len(info.entries)>0:
+        elif info.has_key("entries") and \
+             (len(info.entries)>0 or info.get("truncated")):
            self.url_status = str(200)
         elif info.bozo and info.bozo_exception.__class__.__name__=='Timeout':
            self.url_status = str(408)
+        elif info.bozo and info.bozo_exception.__class__.__name__=='TooLarge':
+           self.url_status = str(413)
         else:
            self.url_status = str(500)
+        self.update_expires(int(self.url_status), info.get("headers"))
 
         if self.url_status == '301' and \
-           (info.has_key("entries") and len(info.entries)>0):
+           (info.has_key("entries") and
+            (len(info.entries)>0 or info.get("truncated"))):
             log.warning("Feed has moved from <%s> to <%s>", self.url, info.url)
             try:
                 os.link(cache.filename(self._planet.cache_directory, self.url),
@@ -627,6 +1861,8 @@ class Channel(cache.CachedInfo):
             self.url = info.url
         elif self.url_status == '304':
             log.info("Feed %s unchanged", self.feed_information())
+            self.succeeded()
+            self.not_modified(info.get("headers"))
             return
         elif self.url_status == '410':
             log.info("Feed %s gone", self.feed_information())
@@ -634,10 +1870,12 @@ class Channel(cache.CachedInfo):
             return
         elif self.url_status == '408':
             log.warning("Feed %s timed out", self.feed_information())
+            self.failed()
             return
         elif int(self.url_status) >= 400:
             log.error("Error %s while updating feed %s",
                       self.url_status, self.feed_information())
+            self.failed()
             return
         else:
             log.info("Updating feed %s", self.feed_information())
@@ -651,9 +1889,25 @@ class Channel(cache.CachedInfo):
                       time.strftime(TIMEFMT_ISO, self.url_modified))
 
         self.update_info(info.feed)
-        self.update_entries(info.entries)
+        self.update_entries(info.entries, info.get("truncated"),
+                            info.get("stopped_at_known"))
+        self.succeeded()
+        self.url_digest = digest
+        if info.has_key("hints"):
+            self.url_encoding = info.hints["encoding"] or None
+            self.url_declared = info.hints["declared"]
+            self.url_strict = str(info.hints["strict"])
+            self.url_strict_skipped = str(info.hints["skipped"])
+        self.url_not_modified = "0"
+        self.schedule(info.get("headers"))
         self.cache_write()
 
+    def not_modified(self, headers):
+        """Record that the feed hasn't changed since we last processed it."""
+        self.url_not_modified = str(int(self.url_not_modified) + 1)
+        self.schedule(headers)
+        self.cache_write(items=0)
+
     def update_info(self, feed):
         """Update information from the feed.
 
@@ -698,12 +1952,6 @@ class Channel(cache.CachedInfo):
             elif isinstance(feed[key], (str, unicode)):
                 # String fields
                 try:
-                    detail = key + '_detail'
-                    if feed.has_key(detail) and feed[detail].has_key('type'):
-                        if feed[detail].type == 'text/html':
-                            feed[key] = sanitize.HTML(feed[key])
-                        elif feed[detail].type == 'text/plain':
-                            feed[key] = escape(feed[key])
                     self.set_as_string(key, feed[key])
                 except KeyboardInterrupt:
                     raise
@@ -711,7 +1959,12 @@ class Channel(cache.CachedInfo):
                     log.exception("Ignored '%s' of <%s>, unknown format",
                                   key, self.url)
 
-    def update_entries(self, entries):
+        # The plain text title, for the templates
+        if self.has_key("title"):
+            self.set_as_string("title_plain",
+                               plain_text(self.get_as_string("title")))
+
+    def update_entries(self, entries, truncated=0, stopped_at_known=None):
         """Update entries from the feed.
 
         This reads the entries supplied by feedparser and updates the
@@ -724,9 +1977,14 @@ class Channel(cache.CachedInfo):
 
         If the feed does not contain items which, according to the sort order,
         should be there; those items are assumed to have been expired from
-        the feed or replaced and are removed from the cache.
+        the feed or replaced and are removed from the cache.  When parsing
+        was truncated the rest of the feed wasn't seen, so the check stops
+        at the last entry given, looking at hidden items too so as to find
+        it, and the items after it are kept.  When it stopped at known
+        entries, which aren't given, stopped_at_known lists their ids and
+        they count as the last entries given.
         """
-        if not len(entries):
+        if not len(entries) and not stopped_at_known:
             return
 
         self.last_updated = self.updated
@@ -772,13 +2030,18 @@ class Channel(cache.CachedInfo):
             item.order = self.next_order = str(int(self.next_order) + 1)
 
         # Check for expired or replaced items
+        if stopped_at_known:
+            feed_items.extend(stopped_at_known)
+            truncated = 1
         feed_count = len(feed_items)
         log.debug("Items in Feed: %d", feed_count)
-        for item in self.items(sorted=1):
+        for item in self.items(hidden=truncated, sorted=1):
             if feed_count < 1:
                 break
             elif item.id in feed_items:
                 feed_count -= 1
+                if truncated and item.id == feed_items[-1]:
+                    break
             elif item._channel.url_status != '226':
                 del(self._items[item.id])
                 self._expired.append(item)
@@ -880,10 +2143,6 @@ class NewsItem(cache.CachedInfo):
                 # Content field: concatenate the values
                 value = ""
                 for item in entry[key]:
-                    if item.type == 'text/html':
-                        item.value = sanitize.HTML(item.value)
-                    elif item.type == 'text/plain':
-                        item.value = escape(item.value)
                     if item.has_key('language') and item.language and \
                        (not self._channel.has_key('language') or
                        item.language != self._channel.language) :
@@ -893,13 +2152,6 @@ class NewsItem(cache.CachedInfo):
             elif isinstance(entry[key], (str, unicode)):
                 # String fields
                 try:
-                    detail = key + '_detail'
-                    if entry.has_key(detail):
-                        if entry[detail].has_key('type'):
-                            if entry[detail].type == 'text/html':
-                                entry[key] = sanitize.HTML(entry[key])
-                            elif entry[detail].type == 'text/plain':
-                                entry[key] = escape(entry[key])
                     self.set_as_string(key, entry[key])
                 except KeyboardInterrupt:
                     raise
@@ -907,6 +2159,11 @@ class NewsItem(cache.CachedInfo):
                     log.exception("Ignored '%s' of <%s>, unknown format",
                                   key, self.id)
 
+        # Strip the title once here, rather than for every template
+        if self.has_key("title"):
+            self.set_as_string("title_plain",
+                               plain_text(self.get_as_string("title")))
+
         # Generate the date field if we need to
         self.get_date("date")
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Caching DNS resolver.
+
+Every feed fetch looks up its host name again, even though most of the
+feeds on a planet live on a handful of hosts, and a slow resolver can
+then account for much of a run.  This module remembers the results of
+socket.getaddrinfo() for a while, including names which don't exist,
+and keeps count of the time spent actually resolving names so that it
+can be told apart from the time spent connecting and transferring.
+
+Once installed, the cache is used by everything that resolves names
+through socket.getaddrinfo(), which includes httplib and planet.fetcher.
+"""
+
+import time
+import socket
+
+try:
+    import threading
+except:
+    threading = None
+
+
+# Default number of seconds to remember a name's addresses
+TTL = 300
+
+# Default number of seconds to remember that a name doesn't exist
+NEGATIVE_TTL = 60
+
+# getaddrinfo() errors which mean the name doesn't exist, rather than
+# that the lookup failed and might succeed if tried again
+NXDOMAIN = [ getattr(socket, name) for name in ("EAI_NONAME", "EAI_NODATA")
+             if hasattr(socket, name) ]
+
+# The real resolver, from before any cache was installed
+_getaddrinfo = socket.getaddrinfo
+
+
+class Resolver:
+    """A TTL-bounded cache of getaddrinfo() results.
+
+    Properties:
+        ttl             Seconds to remember a name's addresses for.
+        negative_ttl    Seconds to remember that a name doesn't exist.
+        hits            Number of lookups answered from the cache.
+        misses          Number of lookups passed on to the resolver.
+        resolve_time    Seconds spent, over all threads, resolving.
+    """
+    def __init__(self, ttl=TTL, negative_ttl=NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.resolve_time = 0.0
+
+        self._cache = {}
+        if threading:
+            self._lock = threading.Lock()
+            self._local = threading.local()
+        else:
+            self._lock = None
+            self._local = None
+
+    def getaddrinfo(self, host, port, family=0, socktype=0, proto=0, flags=0):
+        """Resolve a name like socket.getaddrinfo(), using the cache."""
+        key = (host, port, family, socktype, proto, flags)
+        now = time.time()
+        if self._lock: self._lock.acquire()
+        try:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                result = entry[1]
+                if isinstance(result, socket.gaierror):
+                    raise result
+                return list(result)
+            self.misses += 1
+        finally:
+            if self._lock: self._lock.release()
+
+        start = time.time()
+        try:
+            result = _getaddrinfo(host, port, family, socktype, proto, flags)
+        except socket.gaierror, e:
+            self._resolved(start)
+            if e.args and e.args[0] in NXDOMAIN and self.negative_ttl > 0:
+                self._store(key, start + self.negative_ttl, e)
+            raise
+        self._resolved(start)
+        self._store(key, start + self.ttl, result)
+        return list(result)
+
+    def thread_time(self):
+        """Return the seconds the current thread has spent resolving."""
+        if self._local is None:
+            return self.resolve_time
+        return getattr(self._local, "resolve_time", 0.0)
+
+    def install(self):
+        """Use this cache for all calls to socket.getaddrinfo()."""
+        socket.getaddrinfo = self.getaddrinfo
+
+    def uninstall(self):
+        """Go back to the real socket.getaddrinfo()."""
+        socket.getaddrinfo = _getaddrinfo
+
+    def _resolved(self, start):
+        """Count the time spent in a lookup that started at start."""
+        elapsed = time.time() - start
+        if self._local is not None:
+            self._local.resolve_time = self.thread_time() + elapsed
+        if self._lock: self._lock.acquire()
+        try:
+            self.resolve_time += elapsed
+        finally:
+            if self._lock: self._lock.release()
+
+    def _store(self, key, expires, result):
+        if self._lock: self._lock.acquire()
+        try:
+            self._cache[key] = (expires, result)
+        finally:
+            if self._lock: self._lock.release()
@@ -65,8 +65,37 @@ TIDY_MARKUP = 0
 # if TIDY_MARKUP = 1
 PREFERRED_TIDY_INTERFACES = ["uTidy", "mxTidy"]
 
+# If you want embedded HTML cleaned up by a sanitizer of your own, which also
+# resolves relative URIs so that the markup is only parsed once, set this to it.
+# It's called with the markup, its encoding and its base URI, and replaces both
+# of feedparser's own passes over text/html; XHTML is still handled as usual.
+# What it returns is also what's kept in the element's _detail.
+HTML_SANITIZER = None
+
+# Number of date strings to remember the parsed value of, most recently used
+# first.  Set this to 0 to parse every date afresh.
+DATE_CACHE_SIZE = 1000
+
+# If you want well-formed RSS 2.0 and Atom 1.0 feeds parsed by calling feedparser
+# straight from pyexpat, rather than through the SAX interface, set this to 1.
+# Anything else, or anything out of the ordinary, still goes the usual way.
+FAST_XML_PARSER = 0
+
+# If you want date handlers that parsed a date to be tried first for later dates
+# of the same shape (the same apart from their digits), set this to 1.  Where the
+# formats of two handlers overlap, an ambiguous or garbage date may then be parsed
+# by a different handler than usual, so by default the handlers are always tried
+# in the order they were registered.
+ADAPTIVE_DATE_HANDLERS = 0
+
+# Number of parses in a row the strict parser is skipped for, when the hints
+# from the last parse say it failed on the feed, before it's tried again in case
+# the feed has been fixed.
+STRICT_PARSER_SKIPS = 5
+
 # ---------- required modules (should come with any Python distribution) ----------
 import sgmllib, re, sys, copy, urlparse, time, rfc822, types, cgi, urllib, urllib2
+import codecs
 try:
     from cStringIO import StringIO as _StringIO
 except:
@@ -103,6 +132,12 @@ except:
             data = data.replace(char, entity)
         return data
 
+# pyexpat, for FAST_XML_PARSER
+try:
+    import pyexpat
+except:
+    pyexpat = None
+
 # base64 support for Atom feeds that contain embedded binary data
 try:
     import base64, binascii
@@ -136,6 +171,8 @@ class CharacterEncodingOverride(ThingsNobodyCaresAboutButMe): pass
 class CharacterEncodingUnknown(ThingsNobodyCaresAboutButMe): pass
 class NonXMLContentType(ThingsNobodyCaresAboutButMe): pass
 class UndeclaredNamespace(Exception): pass
+class _StopParsing(Exception): pass
+class _NotFastParsed(Exception): pass
 
 sgmllib.tagfind = re.compile('[a-zA-Z][-_.:a-zA-Z0-9]*')
 sgmllib.special = re.compile('<!')
@@ -246,6 +283,92 @@ class FeedParserDict(UserDict):
     def __contains__(self, key):
         return self.has_key(key)
 
+class _DictFeedParserDict(dict):
+    '''A FeedParserDict which is a dict, with its key aliases worked out in advance
+
+    Behaves like the UserDict-based FeedParserDict, including has_key() being
+    true for the names of its methods, but looks most keys up with a single
+    dict lookup rather than walking keymap on every access.
+    '''
+    keymap = FeedParserDict.keymap
+    _getmap = {}
+    _setmap = {}
+    for k, v in keymap.items():
+        if type(v) == types.ListType:
+            _getmap[k] = tuple(v) + (k,)
+            _setmap[k] = v[0]
+        else:
+            _getmap[k] = (k, v)
+            _setmap[k] = v
+    del k, v
+
+    def __getitem__(self, key):
+        if key == 'category':
+            return dict.__getitem__(self, 'tags')[0]['term']
+        if key == 'categories':
+            return [(tag['scheme'], tag['term']) for tag in dict.__getitem__(self, 'tags')]
+        keys = self._getmap.get(key)
+        if keys is None:
+            return dict.__getitem__(self, key)
+        for k in keys:
+            if dict.__contains__(self, k):
+                return dict.__getitem__(self, k)
+        raise KeyError, key
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, self._setmap.get(key, key), value)
+
+    def get(self, key, default=None):
+        if self.has_key(key):
+            return self[key]
+        else:
+            return default
+
+    def setdefault(self, key, value):
+        if not self.has_key(key):
+            self[key] = value
+        return self[key]
+
+    def has_key(self, key):
+        if dict.__contains__(self, key) or hasattr(self.__class__, key) \
+               or self.__dict__.has_key(key):
+            return True
+        if self._getmap.has_key(key) or key in ('category', 'categories'):
+            try:
+                self[key]
+                return True
+            except:
+                return False
+        return False
+
+    __contains__ = has_key
+
+    def __getattr__(self, key):
+        try:
+            assert not key.startswith('_')
+            return self.__getitem__(key)
+        except:
+            raise AttributeError, "object has no attribute '%s'" % key
+
+    def __setattr__(self, key, value):
+        if key.startswith('_') or key == 'data':
+            self.__dict__[key] = value
+        else:
+            self.__setitem__(key, value)
+
+    def copy(self):
+        return self.__class__(self)
+
+_UserDictFeedParserDict = FeedParserDict
+
+def useDictFeedParserDict(enable=1):
+    '''Makes parse() return dict-based FeedParserDicts, or UserDict-based ones again'''
+    global FeedParserDict
+    if enable:
+        FeedParserDict = _DictFeedParserDict
+    else:
+        FeedParserDict = _UserDictFeedParserDict
+
 def zopeCompatibilityHack():
     global FeedParserDict
     del FeedParserDict
@@ -395,6 +518,7 @@ class _FeedParserMixin:
         self.entries = [] # list of entry-level data
         self.version = '' # feed type/version, see SUPPORTED_VERSIONS
         self.namespacesInUse = {} # dictionary of namespaces defined by the feed
+        self.stop = None # called with the entries and their number, true to stop parsing
 
         # the following are used internally to track state;
         # this is really out of control and should be refactored
@@ -686,15 +810,20 @@ class _FeedParserMixin:
         except KeyError:
             pass
 
-        # resolve relative URIs within embedded markup
-        if self.mapContentType(self.contentparams.get('type', 'text/html')) in self.html_types:
-            if element in self.can_contain_relative_uris:
-                output = _resolveRelativeURIs(output, self.baseuri, self.encoding)
-        
-        # sanitize embedded markup
-        if self.mapContentType(self.contentparams.get('type', 'text/html')) in self.html_types:
-            if element in self.can_contain_dangerous_markup:
-                output = _sanitizeHTML(output, self.encoding)
+        # resolve relative URIs within, and sanitize, embedded HTML in one pass
+        if HTML_SANITIZER and element in self.can_contain_dangerous_markup and \
+               self.mapContentType(self.contentparams.get('type', 'text/html')) == 'text/html':
+            output = HTML_SANITIZER(output, self.encoding, self.baseuri)
+        else:
+            # resolve relative URIs within embedded markup
+            if self.mapContentType(self.contentparams.get('type', 'text/html')) in self.html_types:
+                if element in self.can_contain_relative_uris:
+                    output = _resolveRelativeURIs(output, self.baseuri, self.encoding)
+
+            # sanitize embedded markup
+            if self.mapContentType(self.contentparams.get('type', 'text/html')) in self.html_types:
+                if element in self.can_contain_dangerous_markup:
+                    output = _sanitizeHTML(output, self.encoding)
 
         if self.encoding and type(output) != type(u''):
             try:
@@ -1090,6 +1219,8 @@ class _FeedParserMixin:
     def _end_item(self):
         self.pop('item')
         self.inentry = 0
+        if self.stop and self.stop(self.entries, len(self.entries)):
+            raise _StopParsing
     _end_entry = _end_item
 
     def _start_dc_language(self, attrsD):
@@ -1473,6 +1604,100 @@ if _XML_AVAILABLE:
             self.error(exc)
             raise exc
 
+    class _ExpatFeedParser(_StrictFeedParser):
+        '''Parses RSS 2.0 and Atom 1.0 feeds with pyexpat callbacks
+
+        Element and attribute names are translated exactly as the SAX parser
+        and _StrictFeedParser would, but once for each name rather than for
+        each element, without the SAX objects in between.  parse() raises
+        _NotFastParsed for any other kind of feed, or for a document type
+        declaration or entity, which the usual parser should be used for.
+        '''
+        fast_versions = ['rss20', 'atom10']
+
+        def __init__(self, baseuri, baselang, encoding):
+            _StrictFeedParser.__init__(self, baseuri, baselang, encoding)
+            self._startnames = {}
+            self._endnames = {}
+            self._attrnames = {}
+            self._checked = 0
+
+        def parse(self, data):
+            parser = pyexpat.ParserCreate(None, ' ')
+            parser.namespace_prefixes = 1
+            parser.buffer_text = 1
+            parser.StartElementHandler = self._startElement
+            parser.EndElementHandler = self._endElement
+            parser.CharacterDataHandler = self.handle_data
+            parser.StartNamespaceDeclHandler = self.trackNamespace
+            parser.StartDoctypeDeclHandler = self._unusual
+            parser.EntityDeclHandler = self._unusual
+            parser.SkippedEntityHandler = self._unusual
+            parser.ExternalEntityRefHandler = self._unusual
+            parser.Parse(data, 1)
+
+        def _unusual(self, *args):
+            raise _NotFastParsed
+
+        def _splitName(self, name):
+            parts = name.split()
+            if len(parts) == 1:
+                return None, name, name
+            elif len(parts) == 3:
+                return parts[0], parts[1], '%s:%s' % (parts[2], parts[1])
+            return parts[0], parts[1], parts[1]
+
+        def _startElement(self, name, attrs):
+            localname = self._startnames.get(name)
+            if localname is None:
+                # as startElementNS, which the SAX parser gives no qname
+                namespace, localname, qname = self._splitName(name)
+                lowernamespace = str(namespace or '').lower()
+                if lowernamespace.find('backend.userland.com/rss') <> -1:
+                    lowernamespace = 'http://backend.userland.com/rss'
+                prefix = self._matchnamespaces.get(lowernamespace)
+                if prefix:
+                    localname = prefix + ':' + localname
+                localname = self._startnames[name] = str(localname).lower()
+            if attrs:
+                # as startElementNS, with the SAX parser's AttributesNSImpl
+                newattrs = {}
+                qnames = {}
+                for aname, value in attrs.items():
+                    names = self._attrnames.get(aname)
+                    if names is None:
+                        namespace, attrlocalname, qname = self._splitName(aname)
+                        names = self._attrnames[aname] = ((namespace, attrlocalname), qname)
+                    newattrs[names[0]] = value
+                    qnames[names[0]] = names[1]
+                attrsD = {}
+                for (namespace, attrlocalname), attrvalue in newattrs.items():
+                    prefix = self._matchnamespaces.get((namespace or '').lower(), '')
+                    if prefix:
+                        attrlocalname = prefix + ':' + attrlocalname
+                    attrsD[str(attrlocalname).lower()] = attrvalue
+                for apair, qname in qnames.items():
+                    attrsD[str(qname).lower()] = newattrs[apair]
+                attrs = attrsD.items()
+            else:
+                attrs = []
+            self.unknown_starttag(localname, attrs)
+            if not self._checked:
+                if self.version not in self.fast_versions:
+                    raise _NotFastParsed
+                self._checked = 1
+
+        def _endElement(self, name):
+            localname = self._endnames.get(name)
+            if localname is None:
+                # as endElementNS, which the SAX parser gives no qname
+                namespace, localname, qname = self._splitName(name)
+                prefix = self._matchnamespaces.get(str(namespace or '').lower(), '')
+                if prefix:
+                    localname = prefix + ':' + localname
+                localname = self._endnames[name] = str(localname).lower()
+            self.unknown_endtag(localname)
+
 class _BaseHTMLProcessor(sgmllib.SGMLParser):
     elements_no_end_tag = ['area', 'base', 'basefont', 'br', 'col', 'frame', 'hr',
       'img', 'input', 'isindex', 'link', 'meta', 'param']
@@ -1907,6 +2132,16 @@ _date_handlers = []
 def registerDateHandler(func):
     '''Register a date handler function (takes string, returns 9-tuple date in GMT)'''
     _date_handlers.insert(0, func)
+    _date_cache.clear()
+    _date_shapes.clear()
+
+# parsed dates by date string, each with the tick it was last used at
+_date_cache = {}
+_date_cache_tick = [0]
+
+# date handler that parsed a date string, by the string's shape
+_date_shapes = {}
+_date_shape_re = re.compile(r'\d')
     
 # ISO-8601 date parsing routines written by Fazal Majid.
 # The ISO 8601 standard is very convoluted and irregular - a full ISO 8601
@@ -2297,20 +2532,61 @@ rfc822._timezones.update(_additional_timezones)
 registerDateHandler(_parse_date_rfc822)    
 
 def _parse_date(dateString):
-    '''Parses a variety of date formats into a 9-tuple in GMT'''
-    for handler in _date_handlers:
-        try:
-            date9tuple = handler(dateString)
-            if not date9tuple: continue
-            if len(date9tuple) != 9:
-                if _debug: sys.stderr.write('date handler function must return 9-tuple\n')
-                raise ValueError
-            map(int, date9tuple)
-            return date9tuple
-        except Exception, e:
-            if _debug: sys.stderr.write('%s raised %s\n' % (handler.__name__, repr(e)))
-            pass
-    return None
+    '''Parses a variety of date formats into a 9-tuple in GMT
+
+    Results are remembered for the DATE_CACHE_SIZE most recently used date
+    strings, and with ADAPTIVE_DATE_HANDLERS the handler which parsed a date
+    is tried first for the next date of the same shape, rather than after all
+    the handlers registered later have failed.
+    '''
+    if DATE_CACHE_SIZE:
+        _date_cache_tick[0] += 1
+        cached = _date_cache.get(dateString)
+        if cached is not None:
+            cached[1] = _date_cache_tick[0]
+            return cached[0]
+
+    handlers = _date_handlers
+    if ADAPTIVE_DATE_HANDLERS:
+        shape = _date_shape_re.sub('0', dateString)
+        first = _date_shapes.get(shape)
+        if first in handlers:
+            handlers = [first] + [h for h in handlers if h is not first]
+    date9tuple = None
+    for handler in handlers:
+        date9tuple = _tryDateHandler(handler, dateString)
+        if date9tuple:
+            if ADAPTIVE_DATE_HANDLERS:
+                if len(_date_shapes) >= max(DATE_CACHE_SIZE, 100):
+                    _date_shapes.clear()
+                _date_shapes[shape] = handler
+            break
+
+    if DATE_CACHE_SIZE:
+        if len(_date_cache) >= DATE_CACHE_SIZE:
+            # forget the least recently used quarter
+            ticks = [entry[1] for entry in _date_cache.values()]
+            ticks.sort()
+            oldest = ticks[len(ticks) / 4]
+            for key, entry in _date_cache.items():
+                if entry[1] <= oldest:
+                    _date_cache.pop(key, None)
+        _date_cache[dateString] = [date9tuple, _date_cache_tick[0]]
+    return date9tuple
+
+def _tryDateHandler(handler, dateString):
+    '''Returns the 9-tuple a date handler parses dateString into, or None'''
+    try:
+        date9tuple = handler(dateString)
+        if not date9tuple: return None
+        if len(date9tuple) != 9:
+            if _debug: sys.stderr.write('date handler function must return 9-tuple\n')
+            raise ValueError
+        map(int, date9tuple)
+        return date9tuple
+    except Exception, e:
+        if _debug: sys.stderr.write('%s raised %s\n' % (handler.__name__, repr(e)))
+        return None
 
 def _getCharacterEncoding(http_headers, xml_data):
     '''Get the character encoding of the XML document
@@ -2519,8 +2795,150 @@ def _stripDoctype(data):
     data = doctype_pattern.sub('', data)
     return version, data
     
-def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=[]):
-    '''Parse a feed from a URL, file, stream, or string'''
+class _IncrementalParser:
+    '''Strictly parses a feed while it is still being downloaded
+
+    Data is passed to feed() as it arrives and straight on to an incremental
+    SAX parser, rather than parse() converting and parsing the whole document
+    once it is all in memory.  Only the common case is handled: an
+    ASCII-compatible document in the encoding parse() would try first, with
+    no DOCTYPE or ENTITY declarations for parse() to strip out.
+
+    If the document turns out to be any different, or the strict parser
+    fails, result() returns None and the document must be given to parse()
+    as usual, which then falls back on the loose parser as it always has.
+    Otherwise the result is used by parse() when it is attached to the file
+    object as its 'parsed' attribute.
+    '''
+    def __init__(self, href, http_headers):
+        self.href = href
+        self.http_headers = http_headers or {}
+        self.failed = not _XML_AVAILABLE
+        self.encoding = None
+        self._head = ''
+        self._decoder = None
+        self._handler = None
+        self._saxparser = None
+        self._tail = u''
+
+    def feed(self, data):
+        if self.failed: return
+        try:
+            if self._decoder is None:
+                self._head += data
+                self._start(0)
+            else:
+                self._feed(self._decoder.decode(data))
+        except:
+            self._fail()
+
+    def close(self):
+        if self.failed: return
+        try:
+            if self._decoder is None:
+                self._start(1)
+            if not self.failed:
+                self._feed(self._decoder.decode('', 1))
+                self._saxparser.close()
+        except:
+            self._fail()
+
+    def result(self):
+        if self.failed or self._handler is None:
+            return None
+        return {'encoding': self.encoding,
+                'feed': self._handler.feeddata,
+                'entries': self._handler.entries,
+                'version': self._handler.version,
+                'namespaces': self._handler.namespacesInUse}
+
+    def _fail(self):
+        if _debug: sys.stderr.write('incremental parse abandoned\n')
+        self.failed = 1
+        self._head = ''
+        self._handler = None
+        self._saxparser = None
+
+    def _start(self, final):
+        # wait for everything _getCharacterEncoding and _toUTF8 look at:
+        # the first line, and the whole of any XML declaration
+        head = self._head
+        if not final:
+            if head.find('\n') < 0: return
+            if head.startswith('<?xml') and head.find('>') < 0: return
+        encoding, http_encoding, xml_encoding, sniffed_xml_encoding, acceptable_content_type = \
+            _getCharacterEncoding(self.http_headers, head)
+        if sniffed_xml_encoding or head[:4] == '\x4c\x6f\xa7\x94' or not encoding:
+            self._fail()
+            return
+        self.encoding = encoding
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+
+        baseuri = self.http_headers.get('content-location', self.href)
+        baselang = self.http_headers.get('content-language', None)
+        self._handler = _StrictFeedParser(baseuri, baselang, 'utf-8')
+        self._saxparser = xml.sax.make_parser(PREFERRED_XML_PARSERS)
+        self._saxparser.setFeature(xml.sax.handler.feature_namespaces, 1)
+        self._saxparser.setContentHandler(self._handler)
+        self._saxparser.setErrorHandler(self._handler)
+        if hasattr(self._saxparser, '_ns_stack'):
+            # work around bug in built-in SAX parser (doesn't recognize xml: namespace)
+            self._saxparser._ns_stack.append({'http://www.w3.org/XML/1998/namespace':'xml'})
+
+        # declare the document to be utf-8, as _toUTF8 does
+        text = self._decoder.decode(head)
+        self._head = ''
+        declmatch = re.compile(u'^<\?xml[^>]*?>')
+        newdecl = u"<?xml version='1.0' encoding='utf-8'?>"
+        if declmatch.search(text):
+            text = declmatch.sub(newdecl, text)
+        else:
+            text = newdecl + u'\n' + text
+        self._feed(text)
+
+    def _feed(self, text):
+        # parse() would strip these out with _stripDoctype first
+        check = self._tail + text
+        if check.find(u'<!DOCTYPE') >= 0 or check.find(u'<!ENTITY') >= 0:
+            raise ValueError, 'document has declarations to strip'
+        self._tail = check[-8:]
+        self._saxparser.feed(text.encode('utf-8'))
+
+def _stopEntries(entries, stop):
+    '''Return the entries up to where stop() is first true, and whether it was'''
+    for count in range(1, len(entries) + 1):
+        if stop(entries, count):
+            return entries[:count], 1
+    return entries, 0
+
+def _looseParse(data, baseuri, baselang, encoding, stop, result):
+    '''Parses data with the loose parser, returning the parser'''
+    feedparser = _LooseFeedParser(baseuri, baselang, encoding)
+    feedparser.stop = stop
+    try:
+        feedparser.feed(data)
+    except _StopParsing:
+        result['truncated'] = 1
+    return feedparser
+
+def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=[], stop=None, hints=None):
+    '''Parse a feed from a URL, file, stream, or string
+
+    If stop is given it is called each time another entry is completed, with
+    a list of entries and the number of them parsed so far; only that many at
+    the start of the list are to be looked at.  If it returns true parsing
+    stops there: those entries are returned and result['truncated'] is set.
+    Anything later in the document, including feed elements, is skipped.
+
+    How the document was decoded and parsed is returned as result['hints'].
+    If that is given back as hints for the next parse of the same feed, and
+    the feed still declares the same encodings, the encoding that worked is
+    tried first if it's one of those, and otherwise straight after them; and
+    if the strict parser failed, the loose parser is used straight away unless
+    it finds no entries, for up to STRICT_PARSER_SKIPS parses before the
+    strict parser is tried again.  Either way the usual order is gone back to
+    on failure.
+    '''
     result = FeedParserDict()
     result['feed'] = FeedParserDict()
     result['entries'] = []
@@ -2590,7 +3008,26 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             bozo_message = 'no Content-type specified'
         result['bozo'] = 1
         result['bozo_exception'] = NonXMLContentType(bozo_message)
-        
+
+    declared = '/'.join([str(enc) for enc in (result['encoding'], xml_encoding, sniffed_xml_encoding)])
+    if hints and hints.get('declared') != declared:
+        hints = None
+
+    # use the result of an _IncrementalParser, if it managed a strict parse
+    parsed = getattr(f, 'parsed', None)
+    if parsed and result.get('status', 0) != 304:
+        result['hints'] = {'declared': declared, 'encoding': parsed['encoding'], 'strict': 1, 'skipped': 0}
+        result['encoding'] = parsed['encoding']
+        result['version'] = parsed['version']
+        result['feed'] = parsed['feed']
+        result['entries'] = parsed['entries']
+        result['namespaces'] = parsed['namespaces']
+        if stop:
+            result['entries'], truncated = _stopEntries(result['entries'], stop)
+            if truncated:
+                result['truncated'] = 1
+        return result
+
     result['version'], data = _stripDoctype(data)
 
     baseuri = http_headers.get('content-location', result.get('href'))
@@ -2611,8 +3048,16 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
     use_strict_parser = 0
     known_encoding = 0
     tried_encodings = []
-    # try: HTTP encoding, declared XML encoding, encoding sniffed from BOM
-    for proposed_encoding in (result['encoding'], xml_encoding, sniffed_xml_encoding):
+    # try: HTTP encoding, declared XML encoding, encoding sniffed from BOM; and
+    # the encoding that worked last time, first if it's one of those, otherwise
+    # after them, so a feed which needed a fallback is retried as declared
+    hinted_encoding = hints and hints.get('encoding')
+    proposed_encodings = [result['encoding'], xml_encoding, sniffed_xml_encoding]
+    if hinted_encoding in proposed_encodings:
+        proposed_encodings.insert(0, hinted_encoding)
+    else:
+        proposed_encodings.append(hinted_encoding)
+    for proposed_encoding in proposed_encodings:
         if not proposed_encoding: continue
         if proposed_encoding in tried_encodings: continue
         tried_encodings.append(proposed_encoding)
@@ -2667,9 +3112,32 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
 
     if not _XML_AVAILABLE:
         use_strict_parser = 0
-    if use_strict_parser:
+    feedparser = None
+    skipped = 0
+    if use_strict_parser and hints and not hints.get('strict') and \
+           proposed_encoding == hinted_encoding and \
+           hints.get('skipped', 0) < STRICT_PARSER_SKIPS:
+        # the strict parser failed last time, so will most likely fail again
+        feedparser = _looseParse(data, baseuri, baselang, 'utf-8', stop, result)
+        if feedparser.entries:
+            skipped = hints.get('skipped', 0) + 1
+            use_strict_parser = 0
+        else:
+            feedparser = None
+    if use_strict_parser and FAST_XML_PARSER and pyexpat:
+        feedparser = _ExpatFeedParser(baseuri, baselang, 'utf-8')
+        feedparser.stop = stop
+        try:
+            feedparser.parse(data)
+        except _StopParsing:
+            result['truncated'] = 1
+        except Exception, e:
+            if _debug: sys.stderr.write('fast xml parsing abandoned: %s\n' % repr(e))
+            feedparser = None
+    if use_strict_parser and feedparser is None:
         # initialize the SAX parser
         feedparser = _StrictFeedParser(baseuri, baselang, 'utf-8')
+        feedparser.stop = stop
         saxparser = xml.sax.make_parser(PREFERRED_XML_PARSERS)
         saxparser.setFeature(xml.sax.handler.feature_namespaces, 1)
         saxparser.setContentHandler(feedparser)
@@ -2682,6 +3150,8 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             saxparser._ns_stack.append({'http://www.w3.org/XML/1998/namespace':'xml'})
         try:
             saxparser.parse(source)
+        except _StopParsing:
+            result['truncated'] = 1
         except Exception, e:
             if _debug:
                 import traceback
@@ -2691,9 +3161,9 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             result['bozo'] = 1
             result['bozo_exception'] = feedparser.exc or e
             use_strict_parser = 0
-    if not use_strict_parser:
-        feedparser = _LooseFeedParser(baseuri, baselang, known_encoding and 'utf-8' or '')
-        feedparser.feed(data)
+    if not use_strict_parser and not isinstance(feedparser, _LooseFeedParser):
+        feedparser = _looseParse(data, baseuri, baselang, known_encoding and 'utf-8' or '', stop, result)
+    result['hints'] = {'declared': declared, 'encoding': result['encoding'], 'strict': use_strict_parser, 'skipped': skipped}
     result['feed'] = feedparser.feeddata
     result['entries'] = feedparser.entries
     result['version'] = result['version'] or feedparser.version
@@ -0,0 +1,764 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Non-blocking feed fetcher.
+
+Fetching feeds one after the other with urllib2 means a run takes as
+long as the sum of every server's latency.  This module keeps many HTTP
+requests in flight from a single thread by multiplexing non-blocking
+sockets with poll() (or select() where poll() isn't available).
+
+Completed responses are handed back as Response objects which look
+enough like the ones urllib2 returns that feedparser.parse() can read
+them directly, so conditional GET and redirects are dealt with the same
+way whichever path fetched the feed.
+
+Compressed bodies are decompressed by a Decoder as they arrive, which
+also stops reading any feed that grows past a size limit, and can hand
+the feed on to feedparser's incremental parser while it's downloading.
+
+Requests this module can't make itself, for URLs which aren't http or
+redirect away from it, can be handed to a fallback which is run in a
+thread, such as fetching the feed with urllib2.
+"""
+
+import os
+import sys
+import time
+import errno
+import base64
+import select
+import socket
+import Queue
+import urllib
+import rfc822
+import urlparse
+import mimetools
+
+try:
+    from cStringIO import StringIO
+except:
+    from StringIO import StringIO
+
+try:
+    import zlib
+except:
+    zlib = None
+
+try:
+    import threading
+except:
+    threading = None
+
+import feedparser
+
+
+# Raw socket constructor, bypassing the timeoutsocket shim if installed
+_socket = getattr(socket, "_no_timeoutsocket", socket.socket)
+
+# Default maximum number of requests in flight at once
+MAX_ACTIVE = 100
+
+# Maximum number of redirects to follow for a single feed
+MAX_REDIRECTS = 5
+
+# Size of each read from a socket
+READ_SIZE = 16384
+
+# Connection states
+CONNECTING = "connecting"
+SENDING    = "sending"
+READING    = "reading"
+
+
+class Timeout(Exception):
+    """The request took longer than the fetcher's timeout."""
+    pass
+
+class HTTPError(Exception):
+    """The server sent something that isn't an HTTP response."""
+    pass
+
+class TooLarge(Exception):
+    """The feed is larger than the size limit."""
+    pass
+
+class UnsupportedScheme(HTTPError):
+    """The URL, or one a redirect led to, isn't an http URL."""
+    pass
+
+
+class Response:
+    """A complete HTTP response.
+
+    Provides the read(), info() and close() methods and the url, status
+    and headers attributes that feedparser.parse() looks for on the file
+    objects urllib2 returns.  Unlike those, read() may be called more
+    than once, and responses can be pickled to hand them to another
+    process.  If the request failed, read() raises the exception that
+    caused it to fail.
+
+    Properties:
+        url             Final URL of the feed, after any redirects.
+        status          HTTP status (the first redirect status, if any).
+        headers         HTTP headers as a mimetools.Message.
+        error           Exception that caused the request to fail.
+        parsed          Result of parsing the feed while it downloaded,
+                        which feedparser.parse() uses instead of parsing
+                        it again; None if it wasn't, or couldn't be.
+    """
+    def __init__(self, url, status=None, headers=None, data="", error=None):
+        self.url = url
+        self.status = status
+        self.error = error
+        self.parsed = None
+        if headers is None:
+            headers = mimetools.Message(StringIO(""))
+        self.headers = headers
+        self._data = data
+
+    def read(self):
+        if self.error is not None:
+            raise self.error
+        return self._data
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+    # Headers may be backed by a socket, so pickle just their text
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["headers"] = "".join(self.headers.headers)
+        return state
+
+    def __setstate__(self, state):
+        state["headers"] = mimetools.Message(StringIO(state["headers"]))
+        self.__dict__.update(state)
+
+
+class Decoder:
+    """Incremental decoder for a response body.
+
+    Undoes a gzip or deflate Content-Encoding as each piece of the body
+    is fed to it, rather than after the whole body has been read, and
+    raises TooLarge as soon as either the encoded or the decoded body
+    grows past max_bytes.  A body which can't be decompressed decodes to
+    nothing, which is how feedparser treats one.
+
+    If a parser is given, each piece of decoded body is also passed to
+    its feed() method, and its close() method is called at the end.
+
+    Properties:
+        encoding        Content-Encoding being undone, or None.
+        max_bytes       Size limit, or None for no limit.
+        received        Bytes fed to the decoder.
+        length          Bytes of decoded body.
+        error           Exception raised while decompressing, if any.
+    """
+    def __init__(self, encoding=None, max_bytes=None, parser=None):
+        encoding = (encoding or "").strip().lower()
+        self._zlib = None
+        if zlib and encoding == "gzip":
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif zlib and encoding == "deflate":
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        else:
+            encoding = None
+
+        self.encoding = encoding
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.length = 0
+        self.error = None
+        self.parser = parser
+        self._pieces = []
+
+    def feed(self, data):
+        """Decode the next piece of the body."""
+        self.received += len(data)
+        self.check(self.received)
+        if self.error is not None:
+            return
+
+        if self._zlib is None:
+            self._append(data)
+            return
+        try:
+            self._append(self._zlib.decompress(data))
+        except zlib.error, e:
+            self._failed(e)
+
+    def check(self, length):
+        """Raise TooLarge if length is over the size limit."""
+        if self.max_bytes and length > self.max_bytes:
+            raise TooLarge("feed is larger than %d bytes" % self.max_bytes)
+
+    def close(self):
+        """Return the decoded body."""
+        if self._zlib is not None and self.error is None:
+            try:
+                self._append(self._zlib.flush())
+            except zlib.error, e:
+                self._failed(e)
+        if self.parser is not None:
+            self.parser.close()
+        data = "".join(self._pieces)
+        self._pieces = []
+        return data
+
+    def _append(self, data):
+        self.length += len(data)
+        self.check(self.length)
+        self._pieces.append(data)
+        if self.parser is not None:
+            self.parser.feed(data)
+
+    def _failed(self, error):
+        self.error = error
+        self._pieces = []
+        self.length = 0
+        self.parser = None
+
+
+def http_date(modified):
+    """Format a 9-tuple GMT date as an RFC 1123 date for HTTP headers.
+
+    We can't use time.strftime() since %a and %b depend on the locale.
+    """
+    weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+              "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (weekdays[modified[6]],
+        modified[2], months[modified[1] - 1], modified[0],
+        modified[3], modified[4], modified[5])
+
+
+def freshness(headers, now=None):
+    """Return how many seconds a response stays fresh, or None if unknown.
+
+    headers is a dictionary of lower-cased HTTP response headers, as
+    saved by feedparser.  Cache-Control: max-age takes precedence over
+    Expires, as per RFC 2616.
+    """
+    if not headers:
+        return None
+
+    cache_control = headers.get("cache-control", "")
+    for directive in cache_control.lower().split(","):
+        directive = directive.strip()
+        if directive in ("no-cache", "no-store", "must-revalidate"):
+            return 0
+        if directive.startswith("max-age="):
+            try:
+                return max(0, int(directive[len("max-age="):].strip('" ')))
+            except ValueError:
+                pass
+
+    expires = headers.get("expires")
+    if expires:
+        expires = rfc822.parsedate_tz(expires)
+        if expires is None:
+            # Invalid dates, such as "0", mean already expired
+            return 0
+        if now is None:
+            now = time.time()
+        date = headers.get("date") and rfc822.parsedate_tz(headers["date"])
+        if date:
+            now = rfc822.mktime_tz(date)
+        return max(0, rfc822.mktime_tz(expires) - now)
+
+    return None
+
+def retry_after(headers, now=None):
+    """Return how many seconds the server asked us to wait, or None.
+
+    Servers send Retry-After with 429 and 503 responses, either as a
+    number of seconds or as an HTTP date.
+    """
+    if not headers or not headers.get("retry-after"):
+        return None
+
+    value = headers["retry-after"].strip()
+    if value.isdigit():
+        return int(value)
+
+    date = rfc822.parsedate_tz(value)
+    if date is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, rfc822.mktime_tz(date) - now)
+
+
+class _Request:
+    """A single feed request in flight.
+
+    Tracks the socket and progress of the current HTTP exchange, and
+    starts a new exchange when the server redirects us elsewhere.  Once
+    the headers have arrived the body is passed through a Decoder as it
+    is received.  Each of the server's addresses is tried in turn until
+    a connection to one succeeds.
+    """
+    def __init__(self, fetcher, url, callback, etag, modified, agent,
+                 max_bytes=None, fallback=None):
+        self.fetcher = fetcher
+        self.url = url
+        self.callback = callback
+        self.etag = etag
+        self.modified = modified
+        self.agent = agent
+        self.max_bytes = max_bytes
+        self.fallback = fallback
+        self.redirect_status = None
+        self.redirects = 0
+        self.addresses = []
+        self.sock = None
+
+    def open(self):
+        """Start the HTTP exchange with the server for self.url."""
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(self.url)
+        if scheme != "http":
+            raise UnsupportedScheme("unsupported URL scheme '%s'" % scheme)
+
+        auth = None
+        user_passwd, netloc = urllib.splituser(netloc)
+        if user_passwd:
+            auth = base64.encodestring(user_passwd).strip()
+            self.url = urlparse.urlunsplit((scheme, netloc, path,
+                                            query, fragment))
+        host, port = urllib.splitport(netloc)
+        port = int(port or 80)
+
+        if not path:
+            path = "/"
+        if query:
+            path = path + "?" + query
+
+        headers = [ "GET %s HTTP/1.0" % path,
+                    "Host: %s" % netloc,
+                    "User-Agent: %s" % (self.agent or feedparser.USER_AGENT),
+                    "Accept-Encoding: gzip, deflate",
+                    "A-IM: feed",
+                    "Connection: close" ]
+        if feedparser.ACCEPT_HEADER:
+            headers.append("Accept: %s" % feedparser.ACCEPT_HEADER)
+        if self.etag:
+            headers.append("If-None-Match: %s" % self.etag)
+        if self.modified:
+            headers.append("If-Modified-Since: %s" % http_date(self.modified))
+        if auth:
+            headers.append("Authorization: Basic %s" % auth)
+        self.outgoing = "\r\n".join(headers) + "\r\n\r\n"
+        self.incoming = []
+        self.status = None
+        self.headers = None
+        self.body = None
+        self.body_length = None
+
+        self.addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        self.connect()
+
+    def connect(self):
+        """Start connecting to the next of the server's addresses.
+
+        Addresses which can't even be tried, such as IPv6 ones on a host
+        without IPv6, are skipped.
+        """
+        while 1:
+            self.close()
+            family, socktype, proto, canonname, sockaddr = \
+                self.addresses.pop(0)
+            try:
+                self.sock = _socket(family, socktype, proto)
+                self.sock.setblocking(0)
+                err = self.sock.connect_ex(sockaddr)
+                if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    raise socket.error(err, os.strerror(err))
+                break
+            except socket.error:
+                self.close()
+                if not self.addresses:
+                    raise
+
+        self.state = CONNECTING
+        self.deadline = time.time() + self.fetcher.timeout
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def wants_write(self):
+        return self.state in (CONNECTING, SENDING)
+
+    def handle(self):
+        """Make progress on the exchange after the socket became ready.
+
+        Returns a Response once the exchange is complete, otherwise None.
+        """
+        self.deadline = time.time() + self.fetcher.timeout
+
+        if self.state == CONNECTING:
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err and self.addresses:
+                self.connect()
+                return None
+            elif err:
+                raise socket.error(err, os.strerror(err))
+            self.state = SENDING
+
+        if self.state == SENDING:
+            sent = self.sock.send(self.outgoing)
+            self.outgoing = self.outgoing[sent:]
+            if not self.outgoing:
+                self.state = READING
+            return None
+
+        data = self.sock.recv(READ_SIZE)
+        if data:
+            self.receive(data)
+            if not self.complete():
+                return None
+
+        return self.finish()
+
+    def receive(self, data):
+        """Take data from the socket, decoding any body as it arrives."""
+        if self.body is not None:
+            self.body.feed(data)
+            return
+
+        self.incoming.append(data)
+        data = "".join(self.incoming)
+        self.incoming = [data]
+        ends = [ (data.find(sep), len(sep)) for sep in ("\r\n\r\n", "\n\n")
+                 if data.find(sep) >= 0 ]
+        if not ends:
+            return
+        end, length = min(ends)
+        self.incoming = []
+        self.head(data[:end])
+        self.body.feed(data[end + length:])
+
+    def head(self, head):
+        """Parse the status line and headers, and get ready for the body."""
+        lines = head.split("\n")
+        try:
+            version, status = lines[0].split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise HTTPError("bad status line %r" % lines[0])
+        if not version.startswith("HTTP/"):
+            raise HTTPError("bad status line %r" % lines[0])
+        self.status = status
+        self.headers = mimetools.Message(StringIO("\n".join(lines[1:]) + "\n"))
+
+        self.body_length = -1
+        try:
+            self.body_length = int(self.headers.getheader("content-length"))
+        except (TypeError, ValueError):
+            pass
+
+        if self.redirect():
+            # We don't want the body, so there's no point decoding it
+            self.body = Decoder()
+            return
+
+        parser = None
+        if self.fetcher.incremental and status in (200, 226):
+            parser = feedparser._IncrementalParser(self.url, self.headers.dict)
+        self.body = Decoder(self.headers.getheader("content-encoding"),
+                            self.max_bytes, parser)
+
+    def redirect(self):
+        """Return where the response redirects us to, if anywhere."""
+        if self.status / 100 == 3 and self.status != 304:
+            return self.headers.getheader("location")
+        return None
+
+    def complete(self):
+        """Check whether the response has a Content-Length we've reached."""
+        return self.body is not None and self.body_length >= 0 and \
+               self.body.received >= self.body_length
+
+    def finish(self):
+        """Finish the response, following any redirect it contains."""
+        self.close()
+        if self.body is None:
+            raise HTTPError("incomplete response from server")
+        status, headers = self.status, self.headers
+        body = self.body.close()
+        parser = self.body.parser
+        if self.body.encoding:
+            del headers["content-encoding"]
+
+        location = self.redirect()
+        if location:
+            if self.redirects >= MAX_REDIRECTS:
+                raise HTTPError("too many redirects")
+            self.redirects += 1
+            if self.redirect_status is None:
+                self.redirect_status = status
+            self.url = urlparse.urljoin(self.url, location.strip())
+            self.open()
+            return None
+
+        if status == 200 and self.redirect_status is not None:
+            status = self.redirect_status
+        response = Response(self.url, status, headers, body)
+        if parser is not None:
+            response.parsed = parser.result()
+        return response
+
+
+class Fetcher:
+    """A set of feed requests to fetch concurrently.
+
+    Requests are queued with add() and fetched when run() is called; as
+    each completes its callback is called with a Response.  At most
+    max_active requests are in flight at any one time.
+
+    Callbacks are called from run() once the sockets which were ready
+    have been dealt with, so time spent in them doesn't count against
+    the other requests' timeouts.
+
+    Note that host name resolution still blocks, since the standard
+    library offers no way to do it asynchronously.
+
+    Properties:
+        timeout         Seconds of inactivity before a request times out.
+        max_active      Maximum number of requests in flight at once.
+        agent           User-Agent header to send.
+        incremental     Parse feeds as they arrive, see Response.parsed.
+    """
+    def __init__(self, timeout=None, max_active=MAX_ACTIVE, agent=None,
+                 incremental=0):
+        self.timeout = timeout or 60
+        self.max_active = max_active
+        self.agent = agent
+        self.incremental = incremental
+
+        self._queue = []
+        self._active = {}
+        self._done = []
+
+        # Requests handed to fallback threads, and their results
+        self._deadline = None
+        self._fallbacks = Queue.Queue()
+        self._fallen_back = Queue.Queue()
+        self._pending = 0
+        self._threads = []
+
+    def add(self, url, callback, etag=None, modified=None, max_bytes=None,
+            fallback=None):
+        """Queue the URL to be fetched, calling callback with the Response.
+
+        If max_bytes is given the fetch fails with TooLarge as soon as the
+        feed turns out to be larger than that.
+
+        If fallback is given, a function returning the response to pass to
+        callback, it's called in a separate thread to fetch the feed instead
+        whenever the URL, or one it redirects to, isn't an http URL.
+        Otherwise the fetch fails with UnsupportedScheme.
+        """
+        self._queue.append(_Request(self, url, callback, etag, modified,
+                                    self.agent, max_bytes, fallback))
+
+    def run(self, deadline=None):
+        """Fetch all of the queued requests, returning when they're done.
+
+        If deadline is given, no new requests are started once time.time()
+        passes it; those already in flight are allowed to finish.  Returns
+        the number of requests that were never started.
+        """
+        queued = self._queue
+        self._queue = []
+        queued.reverse()
+        self._deadline = deadline
+
+        skipped = 0
+        try:
+            while queued or self._active or self._pending:
+                if deadline is not None and time.time() >= deadline:
+                    skipped += len(queued)
+                    queued = []
+                    if not self._active and not self._pending:
+                        break
+                while queued and \
+                          len(self._active) + self._pending < self.max_active:
+                    request = queued.pop()
+                    try:
+                        request.open()
+                    except KeyboardInterrupt:
+                        raise
+                    except Exception, e:
+                        self.failed(request, e)
+                    else:
+                        self._active[request.fileno()] = request
+
+                if self._pending:
+                    ready = self.wait(0.1)
+                else:
+                    ready = self.wait(1.0)
+                for request in ready:
+                    del(self._active[request.fileno()])
+                    try:
+                        response = request.handle()
+                    except KeyboardInterrupt:
+                        raise
+                    except Exception, e:
+                        self.failed(request, e)
+                        continue
+                    if response is not None:
+                        self.done(request, response)
+                    else:
+                        self._active[request.fileno()] = request
+
+                self.expire()
+                skipped += self.collect(not self._active)
+                self.callbacks()
+        finally:
+            for thread in self._threads:
+                self._fallbacks.put(None)
+            self._threads = []
+
+        return skipped
+
+    def expire(self):
+        """Time out the requests which have been idle for too long.
+
+        The sockets are checked again first, since handling the others may
+        have taken a while; those which are ready are handled by the next
+        pass instead.  A request which timed out connecting tries the next
+        of its server's addresses, if there are any left.
+        """
+        now = time.time()
+        expired = [ request for request in self._active.values()
+                    if request.deadline < now ]
+        if not expired:
+            return
+
+        ready = self.wait(0)
+        for request in expired:
+            if request in ready:
+                continue
+            del(self._active[request.fileno()])
+            if request.state == CONNECTING and request.addresses:
+                try:
+                    request.connect()
+                except KeyboardInterrupt:
+                    raise
+                except Exception, e:
+                    self.failed(request, e)
+                else:
+                    self._active[request.fileno()] = request
+                continue
+            self.done(request, error=Timeout("Fetch of <%s> timed out"
+                                             % request.url))
+
+    def wait(self, timeout):
+        """Return the list of requests whose sockets are ready."""
+        if not self._active:
+            return []
+
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            for fileno, request in self._active.items():
+                if request.wants_write():
+                    poller.register(fileno, select.POLLOUT)
+                else:
+                    poller.register(fileno, select.POLLIN)
+            try:
+                events = poller.poll(timeout * 1000)
+            except select.error, e:
+                if e[0] != errno.EINTR: raise
+                return []
+            return [ self._active[fileno] for fileno, event in events ]
+
+        readers = []
+        writers = []
+        for fileno, request in self._active.items():
+            if request.wants_write():
+                writers.append(fileno)
+            else:
+                readers.append(fileno)
+        try:
+            r, w, x = select.select(readers, writers, readers + writers,
+                                    timeout)
+        except select.error, e:
+            if e[0] != errno.EINTR: raise
+            return []
+        ready = {}
+        for fileno in r + w + x:
+            ready[fileno] = self._active[fileno]
+        return ready.values()
+
+    def failed(self, request, error):
+        """Finish with a request which failed, or hand it to its fallback."""
+        if isinstance(error, UnsupportedScheme) and \
+               request.fallback is not None and threading:
+            request.close()
+            self._pending += 1
+            self._fallbacks.put(request)
+            if len(self._threads) < self._pending:
+                thread = threading.Thread(target=self._fall_back,
+                    name="fetch-fallback-%d" % len(self._threads))
+                thread.setDaemon(1)
+                thread.start()
+                self._threads.append(thread)
+            return
+        self.done(request, error=error)
+
+    def collect(self, block=0):
+        """Finish the requests the fallback threads are done with.
+
+        If block is true, waits a little while for one if there are none
+        yet.  Returns the number which were never started because the
+        deadline had passed.
+        """
+        skipped = 0
+        while self._pending:
+            try:
+                request, response = self._fallen_back.get(block, 1.0)
+            except Queue.Empty:
+                break
+            block = 0
+            self._pending -= 1
+            if response is None:
+                skipped += 1
+            else:
+                self.done(request, response)
+        return skipped
+
+    def _fall_back(self):
+        while 1:
+            request = self._fallbacks.get()
+            if request is None:
+                return
+            if self._deadline is not None and time.time() >= self._deadline:
+                self._fallen_back.put((request, None))
+                continue
+            try:
+                response = request.fallback()
+            except:
+                response = Response(request.url, error=sys.exc_info()[1])
+            self._fallen_back.put((request, response))
+
+    def done(self, request, response=None, error=None):
+        """Finish with the request, and queue its callback to be called."""
+        request.close()
+        if response is None:
+            response = Response(request.url, error=error)
+        self._done.append((request, response))
+
+    def callbacks(self):
+        """Pass the finished requests' responses to their callbacks."""
+        done = self._done
+        self._done = []
+        for request, response in done:
+            request.callback(response)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Persistent HTTP connection pool.
+
+urllib2 opens a new TCP connection for every request it makes and closes
+it straight afterwards, yet many feeds on a planet tend to live on the
+same few hosts.  This module provides a urllib2 handler that keeps
+HTTP/1.1 connections open between requests and reuses them for later
+requests to the same host, within limits on how many idle connections
+are kept and how many requests are made over each one.
+"""
+
+import socket
+import httplib
+import urllib
+import urllib2
+
+try:
+    from cStringIO import StringIO
+except:
+    from StringIO import StringIO
+
+try:
+    import threading
+except:
+    threading = None
+
+from fetcher import TooLarge
+
+
+# Default maximum number of idle connections kept for each host
+MAX_IDLE = 2
+
+# Default maximum number of requests made over a single connection
+MAX_REQUESTS = 100
+
+# Size of each read of a response body
+READ_SIZE = 16384
+
+
+
+class ConnectionPool:
+    """A pool of idle persistent connections, grouped by host.
+
+    Properties:
+        max_idle        Maximum idle connections kept for each host.
+        max_requests    Maximum requests made over a single connection.
+        hits            Number of requests that reused a connection.
+        misses          Number of requests that needed a new connection.
+    """
+    def __init__(self, max_idle=MAX_IDLE, max_requests=MAX_REQUESTS):
+        self.max_idle = max_idle
+        self.max_requests = max_requests
+        self.hits = 0
+        self.misses = 0
+
+        self._idle = {}
+        if threading:
+            self._lock = threading.Lock()
+        else:
+            self._lock = None
+
+    def get(self, host, timeout=None):
+        """Return an idle connection to the host, or a new one.
+
+        Returns a tuple of the connection and the number of requests
+        that have already been made over it.
+        """
+        if self._lock: self._lock.acquire()
+        try:
+            if self._idle.get(host):
+                self.hits += 1
+                return self._idle[host].pop()
+            self.misses += 1
+        finally:
+            if self._lock: self._lock.release()
+
+        conn = httplib.HTTPConnection(host)
+        if timeout is not None:
+            conn.timeout = timeout
+        return (conn, 0)
+
+    def put(self, host, conn, requests):
+        """Return a connection to the pool once its response is read."""
+        if self._lock: self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(host, [])
+            if requests < self.max_requests and len(idle) < self.max_idle:
+                idle.append((conn, requests))
+                return
+        finally:
+            if self._lock: self._lock.release()
+        conn.close()
+
+    def close(self):
+        """Close all of the idle connections."""
+        if self._lock: self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            if self._lock: self._lock.release()
+        for connections in idle.values():
+            for conn, requests in connections:
+                conn.close()
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    """urllib2 handler that makes requests over pooled connections.
+
+    The whole response body is read before the connection is returned
+    to the pool, and handed back as a file-like object that urllib2's
+    error handlers and feedparser treat like any other response.  If
+    max_bytes is given, reading stops with TooLarge as soon as the body
+    turns out to be larger than that, and the connection is dropped.
+    """
+    def __init__(self, pool, max_bytes=None):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool
+        self.max_bytes = max_bytes
+
+    def http_open(self, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError("no host given")
+
+        headers = dict(req.unredirected_hdrs)
+        for key, value in req.headers.items():
+            if not headers.has_key(key):
+                headers[key] = value
+        headers = dict([ (key.title(), value)
+                         for key, value in headers.items() ])
+
+        timeout = getattr(req, "timeout", None)
+        if timeout is getattr(socket, "_GLOBAL_DEFAULT_TIMEOUT", None):
+            timeout = None
+
+        # A reused connection may have been closed by the server since we
+        # last used it, in which case we try again with a fresh one
+        while 1:
+            conn, requests = self.pool.get(host, timeout)
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                response = conn.getresponse()
+                data = self.read(response)
+                break
+            except TooLarge:
+                conn.close()
+                raise
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if not requests:
+                    raise urllib2.URLError(e)
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(host, conn, requests + 1)
+
+        result = urllib.addinfourl(StringIO(data), response.msg,
+                                   req.get_full_url())
+        result.code = response.status
+        result.msg = response.reason
+        return result
+
+    def read(self, response):
+        """Read the whole of the response body, within max_bytes."""
+        if not self.max_bytes:
+            return response.read()
+
+        pieces = []
+        length = 0
+        while 1:
+            data = response.read(READ_SIZE)
+            if not data:
+                break
+            length += len(data)
+            if length > self.max_bytes:
+                raise TooLarge("feed is larger than %d bytes" % self.max_bytes)
+            pieces.append(data)
+        return "".join(pieces)
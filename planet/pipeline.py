@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Staged processing pipeline.
+
+Updating a feed means waiting for the network, then parsing, then
+writing to disk; done one feed at a time the CPU idles while we wait
+for the network and the network idles while we parse.  This module
+provides stages, each a small pool of threads, connected by bounded
+queues so the work on different feeds overlaps while a slow stage
+holds back the ones before it rather than letting work pile up.
+
+Each stage keeps simple statistics on how its threads spent their time
+and how deep its input queue got, so it's easy to see which stage is
+holding up a run.
+"""
+
+import time
+import Queue
+
+try:
+    import threading
+except:
+    threading = None
+
+
+# Default maximum number of items waiting in each stage's input queue
+DEPTH = 10
+
+
+class _Stop:
+    """Marker put on a stage's queue to tell a thread to stop."""
+    pass
+
+
+class Stage:
+    """A pool of threads calling a function on each item of a queue.
+
+    The function is called with the item and a put function which hands
+    results to the next stage.  Exceptions it raises are passed to the
+    error function, if given, and otherwise ignored.
+
+    Properties:
+        name            Name of the stage, for reporting.
+        threads         Number of threads taking items off the queue.
+        items           Number of items processed.
+        busy            Seconds spent, over all threads, processing items.
+        idle            Seconds spent waiting for items to arrive.
+        blocked         Seconds spent waiting for room in the next stage.
+        max_depth       Longest the input queue got.
+        total_depth     Sum of the input queue lengths seen by each item,
+                        for calculating the mean.
+    """
+    def __init__(self, name, function, next=None, threads=1, depth=DEPTH,
+                 error=None):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0
+        self.total_depth = 0
+
+        self._function = function
+        self._next = next
+        self._error = error
+        self._queue = Queue.Queue(depth)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the stage's threads."""
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._run,
+                                      name="%s-%d" % (self.name, i))
+            thread.setDaemon(1)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        """Queue an item for the stage, waiting if the queue is full."""
+        self._queue.put(item)
+
+    def empty(self):
+        """Check whether there are no items waiting for the stage."""
+        return self._queue.empty()
+
+    def close(self):
+        """Wait for the queued items to be processed, and stop the threads.
+
+        Joins with a timeout so that KeyboardInterrupt still gets through.
+        """
+        for thread in self._threads:
+            self._queue.put(_Stop)
+        for thread in self._threads:
+            while thread.isAlive():
+                thread.join(1)
+        self._threads = []
+
+    def report(self):
+        """Return a one-line summary of the stage's statistics."""
+        if self.items:
+            mean_depth = float(self.total_depth) / self.items
+        else:
+            mean_depth = 0.0
+        return ("%s: %d items in %d threads, busy %.2fs, idle %.2fs, "
+                "blocked %.2fs, queue mean %.1f max %d"
+                % (self.name, self.items, self.threads, self.busy,
+                   self.idle, self.blocked, mean_depth, self.max_depth))
+
+    def _count(self, busy=0.0, idle=0.0, blocked=0.0, depth=None):
+        self._lock.acquire()
+        try:
+            self.busy += busy
+            self.idle += idle
+            self.blocked += blocked
+            if depth is not None:
+                self.items += 1
+                self.total_depth += depth
+                self.max_depth = max(self.max_depth, depth)
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while 1:
+            start = time.time()
+            item = self._queue.get()
+            if item is _Stop:
+                self._count(idle=time.time() - start)
+                return
+            depth = self._queue.qsize() + 1
+
+            # Time spent waiting for room in the next stage isn't busy time
+            blocked = [0.0]
+            def put(result, blocked=blocked):
+                start = time.time()
+                self._next.put(result)
+                blocked[0] += time.time() - start
+
+            started = time.time()
+            try:
+                self._function(item, put)
+            except KeyboardInterrupt:
+                raise
+            except:
+                if self._error:
+                    self._error(item)
+
+            self._count(busy=time.time() - started - blocked[0],
+                        idle=started - start, blocked=blocked[0], depth=depth)
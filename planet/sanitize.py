@@ -6,7 +6,7 @@ __author__ = ["Mark Pilgrim <http://diveintomark.org/>",
               "Aaron Swartz <http://www.aaronsw.com/>"]
 __contributors__ = ["Sam Ruby <http://intertwingly.net/>"]
 __license__ = "BSD"
-__version__ = "0.25"
+__version__ = "0.26"
 
 _debug = 0
 
@@ -19,7 +19,19 @@ TIDY_MARKUP = 0
 # if TIDY_MARKUP = 1
 PREFERRED_TIDY_INTERFACES = ["uTidy", "mxTidy"]
 
-import sgmllib, re
+# Default number of sanitized values a Memo remembers
+MEMO_SIZE = 10000
+
+# Engine to sanitize HTML with: "sgmllib", or "regex" for a faster tokenizer
+# which gives the same results, and hands anything unusual on to sgmllib
+ENGINE = "sgmllib"
+
+import sgmllib, re, os, md5, pickle, urlparse, htmlentitydefs
+
+try:
+    import threading
+except:
+    threading = None
 
 # chardet library auto-detects character encodings
 # Download from http://chardet.feedparser.org/
@@ -102,8 +114,12 @@ class _BaseHTMLProcessor(sgmllib.SGMLParser):
         
     def handle_entityref(self, ref):
         # called for each entity reference, e.g. for '&copy;', ref will be 'copy'
-        # Reconstruct the original entity reference.
-        self.pieces.append('&%(ref)s;' % locals())
+        # Reconstruct the original entity reference, escaping unknown ones
+        # as feedparser does.
+        if htmlentitydefs.name2codepoint.has_key(ref):
+            self.pieces.append('&%(ref)s;' % locals())
+        else:
+            self.pieces.append('&amp;%(ref)s' % locals())
 
     def handle_data(self, text):
         # called for each block of plain text, i.e. outside of any tag and
@@ -173,6 +189,16 @@ class _HTMLSanitizer(_BaseHTMLProcessor):
       'usemap', 'valign', 'value', 'vspace', 'width']
 
     ignorable_elements = ['script', 'applet', 'style']
+
+    # Attributes of acceptable elements which are resolved against the base URI
+    relative_uris = [('a', 'href'), ('area', 'href'), ('blockquote', 'cite'),
+      ('del', 'cite'), ('form', 'action'), ('img', 'longdesc'), ('img', 'src'),
+      ('img', 'usemap'), ('input', 'src'), ('input', 'usemap'), ('ins', 'cite'),
+      ('q', 'cite')]
+
+    def __init__(self, encoding, baseuri=None):
+        _BaseHTMLProcessor.__init__(self, encoding)
+        self.baseuri = baseuri
             
     def reset(self):
         _BaseHTMLProcessor.reset(self)
@@ -195,13 +221,17 @@ class _HTMLSanitizer(_BaseHTMLProcessor):
         if tag in self.acceptable_elements:
             attrs = self.normalize_attrs(attrs)
             attrs = [(key, value) for key, value in attrs if key in self.acceptable_attributes]
+            if self.baseuri:
+                attrs = [(key, ((tag, key) in self.relative_uris) and _urljoin(self.baseuri, value) or value) for key, value in attrs]
             if tag not in self.elements_no_end_tag:
                 self.tag_stack.append(tag)
             _BaseHTMLProcessor.unknown_starttag(self, tag, attrs)
         
     def unknown_endtag(self, tag):
         if tag in self.ignorable_elements:
-            self.ignore_level -= 1
+            # a stray end tag mustn't hide the rest of the markup
+            if self.ignore_level:
+                self.ignore_level -= 1
             return
         
         if self.ignore_level:
@@ -230,10 +260,307 @@ class _HTMLSanitizer(_BaseHTMLProcessor):
             text = text.replace('<', '')
             _BaseHTMLProcessor.handle_data(self, text)
 
-def HTML(htmlSource, encoding='utf8'):
-    p = _HTMLSanitizer(encoding)
-    p.feed(htmlSource)
-    data = p.output()
+_entity_or_charref = sgmllib.SGMLParser.entity_or_charref
+_commentclose = re.compile(r'--\s*>')
+_ascii = re.compile(r'[\x00-\x7f]*\Z')
+
+def _convert_ref(match):
+    # sgmllib's conversion of references in attribute values
+    if match.group(2):
+        n = int(match.group(2))
+        if 0 <= n <= 127:
+            return chr(n)
+        return '&#%s%s' % match.groups()[1:]
+    elif match.group(3):
+        return sgmllib.SGMLParser.entitydefs.get(match.group(1)) or \
+            '&%s;' % match.group(1)
+    else:
+        return '&%s' % match.group(1)
+
+_ascii_encodings = {}
+def _ascii_compatible(encoding):
+    try:
+        return _ascii_encodings[encoding]
+    except KeyError:
+        try:
+            compatible = u'<a href="x">'.encode(encoding) == '<a href="x">'
+        except LookupError:
+            compatible = False
+        _ascii_encodings[encoding] = compatible
+        return compatible
+
+class _NotTokenized(Exception):
+    pass
+
+class _RegexSanitizer:
+    """Sanitizes markup just as _HTMLSanitizer does, but faster.
+
+    Tags, references and data are found by the same rules sgmllib uses,
+    then handled in a single loop writing to a single list, with none of
+    sgmllib's method lookups.  Declarations, SGML short tags and
+    encodings which aren't a superset of ASCII raise _NotTokenized, so
+    that _HTMLSanitizer is used instead.
+    """
+    elements_no_end_tag = frozenset(_HTMLSanitizer.elements_no_end_tag)
+    acceptable_elements = frozenset(_HTMLSanitizer.acceptable_elements)
+    acceptable_attributes = frozenset(_HTMLSanitizer.acceptable_attributes)
+    ignorable_elements = frozenset(_HTMLSanitizer.ignorable_elements)
+    relative_uris = frozenset(_HTMLSanitizer.relative_uris)
+
+    def __init__(self, encoding, baseuri=None):
+        if not encoding or not _ascii_compatible(encoding):
+            raise _NotTokenized
+        self.encoding = encoding
+        self.baseuri = baseuri
+
+    def _shorttag_replace(self, match):
+        tag = match.group(1)
+        if tag in self.elements_no_end_tag:
+            return '<' + tag + ' />'
+        else:
+            return '<' + tag + '></' + tag + '>'
+
+    def sanitize(self, data):
+        """Return the sanitized markup."""
+        data = _BaseHTMLProcessor._r_barebang.sub(r'&lt;!\1', data)
+        data = _BaseHTMLProcessor._r_bareamp.sub("&amp;", data)
+        data = _BaseHTMLProcessor._r_shorttag.sub(self._shorttag_replace, data)
+        if type(data) == type(u''):
+            data = data.encode(self.encoding)
+
+        # sgmllib's rules for where each kind of markup begins and ends,
+        # looked up here as feedparser replaces some of them
+        interesting = sgmllib.interesting
+        incomplete = sgmllib.incomplete
+        entityref = sgmllib.entityref
+        charref = sgmllib.charref
+        starttagopen = sgmllib.starttagopen
+        shorttagopen = sgmllib.shorttagopen
+        endbracket = sgmllib.endbracket
+        tagfind = sgmllib.tagfind
+        attrfind = sgmllib.attrfind
+        name2codepoint = htmlentitydefs.name2codepoint
+
+        pieces = []
+        append = pieces.append
+        tag_stack = []
+        ignore_level = 0
+        i = 0
+        n = len(data)
+        while i < n:
+            match = interesting.search(data, i)
+            if match:
+                j = match.start()
+            else:
+                j = n
+            if i < j:
+                if not ignore_level:
+                    append(data[i:j])
+                i = j
+                if i == n:
+                    break
+
+            if data[i] == '&':
+                match = charref.match(data, i)
+                if match:
+                    append('&#%s;' % match.group(1))
+                    i = match.end()
+                    if data[i-1] != ';':
+                        i = i - 1
+                    continue
+                match = entityref.match(data, i)
+                if match:
+                    if name2codepoint.has_key(match.group(1)):
+                        append('&%s;' % match.group(1))
+                    else:
+                        append('&amp;%s' % match.group(1))
+                    i = match.end()
+                    if data[i-1] != ';':
+                        i = i - 1
+                    continue
+                j = incomplete.match(data, i).end()
+                if j == n:
+                    break
+                if not ignore_level:
+                    append(data[i:j])
+                i = j
+                continue
+
+            c = data[i+1:i+2]
+            if c == '>':
+                raise _NotTokenized
+            elif starttagopen.match(data, i):
+                # start tag
+                if shorttagopen.match(data, i):
+                    raise _NotTokenized
+                match = endbracket.search(data, i+1)
+                if not match:
+                    break
+                j = match.start()
+                k = tagfind.match(data, i+1).end()
+                tag = data[i+1:k].lower()
+                attrs = []
+                while k < j:
+                    match = attrfind.match(data, k)
+                    if not match:
+                        break
+                    attrname, rest, attrvalue = match.group(1, 2, 3)
+                    if not rest:
+                        attrvalue = attrname
+                    else:
+                        if (attrvalue[:1] == "'" == attrvalue[-1:] or
+                            attrvalue[:1] == '"' == attrvalue[-1:]):
+                            attrvalue = attrvalue[1:-1]
+                        if '&' in attrvalue:
+                            attrvalue = _entity_or_charref.sub(_convert_ref,
+                                                               attrvalue)
+                    attrs.append((attrname.lower(), attrvalue))
+                    k = match.end()
+                if data[j] == '>':
+                    j = j + 1
+                i = j
+
+                if tag in self.ignorable_elements:
+                    ignore_level += 1
+                    continue
+                if ignore_level or tag not in self.acceptable_elements:
+                    continue
+                strattrs = []
+                for key, value in attrs:
+                    if key not in self.acceptable_attributes:
+                        continue
+                    if key in ('rel', 'type'):
+                        value = value.lower()
+                    if self.baseuri and (tag, key) in self.relative_uris:
+                        value = _urljoin(self.baseuri, value)
+                    strattrs.append((key, value))
+                for attr in strattrs:
+                    if type(attr[1]) != type('') or not _ascii.match(attr[1]):
+                        # the same round trip as _BaseHTMLProcessor, with
+                        # the same errors for values not in the encoding
+                        uattrs = []
+                        for key, value in strattrs:
+                            if type(value) != type(u''):
+                                value = unicode(value, self.encoding)
+                            uattrs.append((unicode(key, self.encoding), value))
+                        strattrs = u''.join([u' %s="%s"' % attr for attr in uattrs]).encode(self.encoding)
+                        break
+                else:
+                    strattrs = ''.join([' %s="%s"' % attr for attr in strattrs])
+                if tag in self.elements_no_end_tag:
+                    append('<%s%s />' % (tag, strattrs))
+                else:
+                    tag_stack.append(tag)
+                    append('<%s%s>' % (tag, strattrs))
+
+            elif c == '/':
+                # end tag
+                match = endbracket.search(data, i+1)
+                if not match:
+                    break
+                j = match.start()
+                tag = data[i+2:j].strip().lower()
+                if data[j] == '>':
+                    j = j + 1
+                i = j
+
+                if tag in self.ignorable_elements:
+                    if ignore_level:
+                        ignore_level -= 1
+                    continue
+                if ignore_level or tag not in self.acceptable_elements or \
+                       tag in self.elements_no_end_tag:
+                    continue
+                if tag in tag_stack:
+                    while 1:
+                        top = tag_stack.pop()
+                        append('</%s>' % top)
+                        if top == tag:
+                            break
+                else:
+                    while tag_stack:
+                        append('</%s>' % tag_stack.pop())
+
+            elif data.startswith('<!--', i):
+                match = _commentclose.search(data, i+4)
+                if not match:
+                    break
+                append('<!--%s-->' % data[i+4:match.start()])
+                i = match.end()
+
+            elif c == '?':
+                # processing instructions are dropped
+                j = data.find('>', i+2)
+                if j < 0:
+                    break
+                i = j + 1
+
+            elif c == '!':
+                raise _NotTokenized
+
+            else:
+                # a '<' on its own is data, which is dropped
+                if i + 1 == n:
+                    break
+                i = i + 1
+
+        while tag_stack:
+            append('</%s>' % tag_stack.pop())
+        return ''.join(pieces)
+
+_urifixer = re.compile('^([A-Za-z][A-Za-z0-9+-.]*://)(/*)(.*?)')
+def _urljoin(base, uri):
+    uri = _urifixer.sub(r'\1\3', uri)
+    return urlparse.urljoin(base, uri)
+
+def HTML(htmlSource, encoding='utf8', baseuri=None):
+    """Sanitize markup, resolving relative URIs in it if baseuri is given."""
+    if _memo is not None:
+        return _memo.HTML(htmlSource, encoding, baseuri)
+    return _HTML(htmlSource, encoding, baseuri)
+
+def HTMLList(htmlSources, pool):
+    """Sanitize a list of markup in a multiprocessing.Pool.
+
+    Returns what HTML() would for each, in the same order, except that a
+    value which can't be sanitized is returned as None.  Values the memo
+    remembers aren't sent to the pool, and the others are remembered.
+    """
+    memo = _memo
+    results = [None] * len(htmlSources)
+    todo = []
+    for i in range(len(htmlSources)):
+        if memo is not None:
+            results[i] = memo.get(htmlSources[i])
+        if results[i] is None:
+            todo.append(i)
+
+    if todo:
+        done = pool.map(_HTMLWorker, [ htmlSources[i] for i in todo ])
+        for i, data in zip(todo, done):
+            results[i] = data
+            if memo is not None and data is not None:
+                memo.add(htmlSources[i], data)
+    return results
+
+def _HTMLWorker(htmlSource):
+    # run in the pool; exceptions aren't always picklable
+    try:
+        return _HTML(htmlSource)
+    except:
+        return None
+
+def _HTML(htmlSource, encoding='utf8', baseuri=None):
+    data = None
+    if ENGINE == "regex":
+        try:
+            data = _RegexSanitizer(encoding, baseuri).sanitize(htmlSource)
+        except _NotTokenized:
+            pass
+    if data is None:
+        p = _HTMLSanitizer(encoding, baseuri)
+        p.feed(htmlSource)
+        data = p.output()
     if TIDY_MARKUP:
         # loop through list of preferred Tidy interfaces looking for one that's installed,
         # then set up a common _tidy function to wrap the interface-specific API.
@@ -269,6 +596,132 @@ def HTML(htmlSource, encoding='utf8'):
     data = data.strip().replace('\r\n', '\n')
     return data
 
+class Memo:
+    """A size-bounded memo of sanitized HTML, keyed by a digest of the markup.
+
+    Titles, summaries and content which haven't changed since they were
+    last sanitized are returned from the memo rather than being parsed
+    again.  The least recently used quarter is forgotten when it's full.
+    It can be saved to a file and loaded again by the next run; a file
+    saved with other sanitizer settings is ignored.
+
+    Properties:
+        size            Number of sanitized values to remember.
+        hits            Number of values returned from the memo.
+        misses          Number of values sanitized and remembered.
+    """
+    def __init__(self, size=MEMO_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._memo = {}
+        self._tick = 0
+        if threading:
+            self._lock = threading.Lock()
+        else:
+            self._lock = None
+
+    def HTML(self, htmlSource, encoding='utf8', baseuri=None):
+        """Sanitize markup like HTML(), using the memo."""
+        data = self.get(htmlSource, encoding, baseuri)
+        if data is None:
+            data = _HTML(htmlSource, encoding, baseuri)
+            self.add(htmlSource, data, encoding, baseuri)
+        return data
+
+    def get(self, htmlSource, encoding='utf8', baseuri=None):
+        """Return the remembered sanitized markup, or None."""
+        key = self._key(htmlSource, encoding, baseuri)
+        if self._lock: self._lock.acquire()
+        try:
+            self._tick += 1
+            cached = self._memo.get(key)
+            if cached is not None:
+                cached[1] = self._tick
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+            return None
+        finally:
+            if self._lock: self._lock.release()
+
+    def add(self, htmlSource, data, encoding='utf8', baseuri=None):
+        """Remember data as the sanitized markup."""
+        key = self._key(htmlSource, encoding, baseuri)
+        if self._lock: self._lock.acquire()
+        try:
+            if len(self._memo) >= self.size:
+                # forget the least recently used quarter
+                ticks = [cached[1] for cached in self._memo.values()]
+                ticks.sort()
+                oldest = ticks[len(ticks) / 4]
+                for k, cached in self._memo.items():
+                    if cached[1] <= oldest:
+                        del self._memo[k]
+            self._memo[key] = [data, self._tick]
+        finally:
+            if self._lock: self._lock.release()
+
+    def hit_rate(self):
+        """Return the percentage of values returned from the memo."""
+        if not self.hits + self.misses:
+            return 0.0
+        return 100.0 * self.hits / (self.hits + self.misses)
+
+    def load(self, filename):
+        """Remember the values saved in filename, if it can be read."""
+        try:
+            f = open(filename, "rb")
+            try:
+                settings, tick, memo = pickle.load(f)
+            finally:
+                f.close()
+        except:
+            return
+        if settings == self._settings():
+            self._tick = tick
+            self._memo = memo
+
+    def save(self, filename):
+        """Save the values remembered to filename for a later run."""
+        if self._lock: self._lock.acquire()
+        try:
+            f = open(filename + ".tmp", "wb")
+            try:
+                pickle.dump((self._settings(), self._tick, self._memo), f,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(filename + ".tmp", filename)
+        finally:
+            if self._lock: self._lock.release()
+
+    def install(self):
+        """Use this memo for all calls to HTML()."""
+        global _memo
+        _memo = self
+
+    def uninstall(self):
+        """Go back to sanitizing every call to HTML()."""
+        global _memo
+        _memo = None
+
+    def _key(self, htmlSource, encoding, baseuri):
+        key = md5.new('%s\0%r\0' % (encoding, baseuri))
+        if type(htmlSource) == type(u''):
+            key.update('u' + htmlSource.encode('utf-8'))
+        else:
+            key.update('s' + htmlSource)
+        return key.digest()
+
+    def _settings(self):
+        return (__version__, TIDY_MARKUP, _HTMLSanitizer.acceptable_elements,
+                _HTMLSanitizer.acceptable_attributes,
+                _HTMLSanitizer.ignorable_elements)
+
+_memo = None
+
 unicode_bom_map = {
   '\x00\x00\xfe\xff': 'utf-32be',
   '\xff\xfe\x00\x00': 'utf-32le',
@@ -81,6 +81,14 @@ Note:  When used in this manner, the connect() routine may still
 block because it happens before the timeout is set.  To avoid
 this, use the 'timeoutsocket.setDefaultSocketTimeout()' function.
 
+Where the socket module has create_connection(), setStaggeredConnect(1)
+replaces it as well, by a version which doesn't wait for each of a host's
+addresses in turn.  Connection attempts to the addresses are started a
+short delay apart, alternating between address families, and the first
+to connect wins.  A host with a broken IPv6 route then costs that delay
+rather than the whole timeout.  The delay can be changed with
+setConnectDelay(), and setStaggeredConnect(0) puts the original back.
+
 Good Luck!
 
 """
@@ -91,12 +99,16 @@ __author__  = "Timothy O'Malley <timo@alum.mit.edu>"
 #
 # Imports
 #
-import select, string
+import select, string, time
 import socket
 if not hasattr(socket, "_no_timeoutsocket"):
     _socket = socket.socket
+    _create_connection = getattr(socket, "create_connection", None)
 else:
     _socket = socket._no_timeoutsocket
+    _create_connection = getattr(socket,
+                                 "_no_timeoutsocket_create_connection", None)
+_socketmodule = socket
 
 
 #
@@ -115,6 +127,7 @@ else:
     _ConnectBusy = ( errno.EINPROGRESS, errno.EALREADY, errno.EWOULDBLOCK )
     _AcceptBusy  = ( errno.EAGAIN, errno.EWOULDBLOCK )
     del errno
+_strerror = os.strerror
 del os
 
 
@@ -128,6 +141,29 @@ def setDefaultSocketTimeout(timeout):
 def getDefaultSocketTimeout():
     return _DefaultTimeout
 
+#
+# Delay before trying the next address in create_connection()
+#
+_ConnectDelay = 0.25
+def setConnectDelay(delay):
+    global _ConnectDelay
+    _ConnectDelay = delay
+def getConnectDelay():
+    return _ConnectDelay
+
+#
+# Whether socket.create_connection() is replaced by ours
+#
+def setStaggeredConnect(enable):
+    if _create_connection is None:
+        return
+    if enable:
+        _socketmodule.create_connection = create_connection
+    else:
+        _socketmodule.create_connection = _create_connection
+def getStaggeredConnect():
+    return getattr(_socketmodule, "create_connection", None) is create_connection
+
 #
 # Exceptions for socket errors and timeouts
 #
@@ -149,6 +185,107 @@ def timeoutsocket(family=AF_INET, type=SOCK_STREAM, proto=None):
     return TimeoutSocket( _socket(family, type), _DefaultTimeout )
 # end timeoutsocket
 
+#
+# Connect to the first address of a host that answers
+#
+def _interleave(addrinfo):
+    # Alternate between address families, keeping the resolver's order
+    # within each family, so one broken family can't hold up the other
+    families = []
+    byfamily = {}
+    for info in addrinfo:
+        if not byfamily.has_key(info[0]):
+            families.append(info[0])
+            byfamily[info[0]] = []
+        byfamily[info[0]].append(info)
+    result = []
+    while families:
+        for family in families[:]:
+            result.append(byfamily[family].pop(0))
+            if not byfamily[family]:
+                families.remove(family)
+    return result
+# end _interleave
+
+def create_connection(address, timeout=None, source_address=None):
+    host, port = address
+    if timeout is getattr(_socketmodule, "_GLOBAL_DEFAULT_TIMEOUT", None):
+        timeout = None
+    if timeout is None:
+        timeout = _DefaultTimeout
+
+    addrinfo = _socketmodule.getaddrinfo(host, port, 0, SOCK_STREAM)
+    addrinfo = _interleave(addrinfo)
+    if timeout is not None:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+
+    pending = []
+    error = None
+    next_attempt = time.time()
+    try:
+        while addrinfo or pending:
+            # Start another attempt if it's time, or nothing is in flight
+            now = time.time()
+            if addrinfo and (not pending or now >= next_attempt):
+                family, socktype, proto, canonname, sockaddr = addrinfo.pop(0)
+                sock = _socket(family, socktype, proto)
+                pending.append(sock)
+                try:
+                    if source_address:
+                        sock.bind(source_address)
+                    sock.setblocking(0)
+                    errcode = sock.connect_ex(sockaddr)
+                except Error, why:
+                    errcode = why[0]
+                if errcode == 0:
+                    pending.remove(sock)
+                    break
+                elif errcode not in _ConnectBusy:
+                    pending.remove(sock)
+                    sock.close()
+                    error = Error(errcode, _strerror(errcode))
+                    continue
+                next_attempt = now + _ConnectDelay
+
+            # Wait for an attempt to finish, or the time for the next one
+            if deadline is not None and now >= deadline:
+                raise Timeout("Attempted connect to %s timed out." % str(address))
+            wait = None
+            if addrinfo:
+                wait = max(0, next_attempt - now)
+            if deadline is not None:
+                if wait is None or wait > deadline - now:
+                    wait = deadline - now
+            r,w,e = select.select([], pending, pending, wait)
+
+            sock = None
+            for ready in w + e:
+                if ready not in pending:
+                    continue
+                pending.remove(ready)
+                errcode = ready.getsockopt(_socketmodule.SOL_SOCKET,
+                                           _socketmodule.SO_ERROR)
+                if errcode == 0:
+                    sock = ready
+                    break
+                ready.close()
+                error = Error(errcode, _strerror(errcode))
+            if sock is not None:
+                break
+        else:
+            if error is None:
+                error = Error("getaddrinfo returns an empty list")
+            raise error
+    finally:
+        for other in pending:
+            other.close()
+
+    sock.setblocking(1)
+    return TimeoutSocket(sock, timeout)
+# end create_connection
+
 #
 # The TimeoutSocket class definition
 #
@@ -419,6 +556,7 @@ class TimeoutFile:
 if not hasattr(socket, "_no_timeoutsocket"):
     socket._no_timeoutsocket = socket.socket
     socket.socket = timeoutsocket
+    socket._no_timeoutsocket_create_connection = _create_connection
 del socket
 socket = timeoutsocket
 # Finis
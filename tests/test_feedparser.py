@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""Tests for planet.feedparser.
+
+Run from the top of the tree with: python -m unittest discover -s tests
+"""
+
+import os
+import glob
+import unittest
+
+from planet import feedparser
+
+
+# Fixture feeds, parsed by the tests below
+FEEDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feeds")
+
+# Fixtures which are well-formed RSS 2.0 or Atom 1.0, so that the fast XML
+# parser should be used for them rather than falling back
+FAST_FEEDS = ["atom10.xml", "atom10-html.xml", "iso-8859-1.xml",
+              "rss20.xml", "rss20-namespaces.xml", "utf-16.xml",
+              "utf-8-stray-byte.xml", "windows-1252.xml"]
+
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Caf%s</title><link>http://example.com/</link>
+<item><title>One</title><guid>urn:one</guid><description>Caf%s</description></item>
+</channel></rss>"""
+
+
+class ParseHintsTest(unittest.TestCase):
+    def test_declared_encoding_hint(self):
+        data = FEED % ("\xc3\xa9", "\xc3\xa9")
+        first = feedparser.parse(data)
+        self.assertEqual(first.hints["encoding"], "utf-8")
+        self.failIf(first.bozo)
+
+        again = feedparser.parse(data, hints=first.hints)
+        self.assertEqual(again.encoding, "utf-8")
+        self.assertEqual(again.entries, first.entries)
+        self.assertEqual(again.hints, first.hints)
+
+    def test_fallback_encoding_hint_recovers(self):
+        # A stray latin-1 byte makes the utf-8 feed fall back to windows-1252
+        broken = feedparser.parse(FEED % ("\xc3\xa9", "\xe9"))
+        self.assertEqual(broken.encoding, "windows-1252")
+        self.assert_(broken.bozo)
+
+        # Once the feed is fixed it's decoded as declared again, exactly as
+        # it would be without the hints
+        data = FEED % ("\xc3\xa9", "\xc3\xa9")
+        fixed = feedparser.parse(data, hints=broken.hints)
+        expected = feedparser.parse(data)
+        self.assertEqual(fixed.encoding, "utf-8")
+        self.failIf(fixed.bozo)
+        self.assertEqual(fixed.feed, expected.feed)
+        self.assertEqual(fixed.entries, expected.entries)
+        self.assertEqual(fixed.hints, expected.hints)
+
+    def test_strict_parser_hint_recovers(self):
+        # An unescaped ampersand makes the strict parser fail
+        broken = feedparser.parse(FEED % ("\xc3\xa9 &", "\xc3\xa9"))
+        self.assert_(broken.bozo)
+        self.assertEqual(broken.hints["strict"], 0)
+
+        # Once the feed is fixed the strict parser is skipped for a while,
+        # without flagging the feed as bozo, and then tried again
+        data = FEED % ("\xc3\xa9", "\xc3\xa9")
+        expected = feedparser.parse(data)
+        hints = broken.hints
+        for i in range(feedparser.STRICT_PARSER_SKIPS):
+            skipped = feedparser.parse(data, hints=hints)
+            self.failIf(skipped.bozo)
+            self.assertEqual(skipped.hints["strict"], 0)
+            self.assertEqual(skipped.hints["skipped"], i + 1)
+            hints = skipped.hints
+        fixed = feedparser.parse(data, hints=hints)
+        self.failIf(fixed.bozo)
+        self.assertEqual(fixed.feed, expected.feed)
+        self.assertEqual(fixed.entries, expected.entries)
+        self.assertEqual(fixed.hints, expected.hints)
+
+    def test_strict_parser_hint_retried(self):
+        data = FEED % ("\xc3\xa9 &", "\xc3\xa9")
+        hints = feedparser.parse(data).hints
+        for i in range(feedparser.STRICT_PARSER_SKIPS):
+            hints = feedparser.parse(data, hints=hints).hints
+        retried = feedparser.parse(data, hints=hints)
+        self.assert_(retried.bozo)
+        self.assertEqual(retried.hints["strict"], 0)
+        self.assertEqual(retried.hints["skipped"], 0)
+
+    def test_fallback_encoding_hint_reused(self):
+        data = FEED % ("\xc3\xa9", "\xe9")
+        first = feedparser.parse(data)
+        again = feedparser.parse(data, hints=first.hints)
+        self.assertEqual(again.encoding, first.encoding)
+        self.assertEqual(again.entries, first.entries)
+
+
+class FastXMLParserTest(unittest.TestCase):
+    def setUp(self):
+        self.setting = feedparser.FAST_XML_PARSER
+        self.parse = feedparser._ExpatFeedParser.parse
+        self.used = []
+        def parse(parser, data):
+            # Only count parses the fast parser finished
+            self.parse(parser, data)
+            self.used.append(1)
+        feedparser._ExpatFeedParser.parse = parse
+
+    def tearDown(self):
+        feedparser.FAST_XML_PARSER = self.setting
+        feedparser._ExpatFeedParser.parse = self.parse
+
+    def fixtures(self):
+        files = glob.glob(os.path.join(FEEDS, "*.xml"))
+        files.sort()
+        self.assert_(files, "no fixture feeds in %s" % FEEDS)
+        return files
+
+    def test_same_results(self):
+        for filename in self.fixtures():
+            name = os.path.basename(filename)
+            data = open(filename, "rb").read()
+
+            feedparser.FAST_XML_PARSER = 0
+            expected = feedparser.parse(data)
+            feedparser.FAST_XML_PARSER = 1
+            del self.used[:]
+            result = feedparser.parse(data)
+
+            self.assert_(expected.entries, "%s: no entries" % name)
+            self.assertEqual(bool(self.used), name in FAST_FEEDS,
+                             "%s: fast parser used: %s" % (name, self.used))
+            keys = expected.keys() + result.keys()
+            for key in keys:
+                if key == "bozo_exception":
+                    continue
+                self.assertEqual(result.get(key), expected.get(key),
+                                 "%s: %s differs" % (name, key))
+            error = result.get("bozo_exception")
+            expected_error = expected.get("bozo_exception")
+            self.assertEqual(error.__class__, expected_error.__class__,
+                             "%s: bozo_exception differs" % name)
+            self.assertEqual(str(error), str(expected_error),
+                             "%s: bozo_exception differs" % name)
+
+    def test_stop(self):
+        def stop(entries, count):
+            return count >= 1
+        for filename in self.fixtures():
+            name = os.path.basename(filename)
+            data = open(filename, "rb").read()
+
+            feedparser.FAST_XML_PARSER = 0
+            expected = feedparser.parse(data, stop=stop)
+            feedparser.FAST_XML_PARSER = 1
+            result = feedparser.parse(data, stop=stop)
+
+            self.assertEqual(len(result.entries), 1, name)
+            self.assertEqual(result.entries, expected.entries, name)
+            self.assertEqual(result.get("truncated"),
+                             expected.get("truncated"), name)
+
+
+if __name__ == "__main__":
+    unittest.main()
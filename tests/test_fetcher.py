@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Tests for planet.fetcher.
+
+Run from the top of the tree with: python -m unittest discover -s tests
+"""
+
+import time
+import socket
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+
+from planet import fetcher
+
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Feed</title>
+<item><title>One</title><guid>urn:one</guid></item>
+</channel></rss>"""
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(0.2)
+        if self.path == "/secure":
+            self.send_response(302)
+            self.send_header("Location", "https://localhost/feed")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(FEED)))
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(1)
+        thread.start()
+        self.getaddrinfo = socket.getaddrinfo
+
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.port, path)
+
+    def fetch(self, engine, url, **kwargs):
+        responses = []
+        engine.add(url, responses.append, **kwargs)
+        engine.run()
+        self.assertEqual(len(responses), 1)
+        return responses[0]
+
+    def test_slow_callback(self):
+        # Time spent in one request's callback isn't counted against the
+        # others, whose responses arrived meanwhile
+        engine = fetcher.Fetcher(timeout=0.5)
+        responses = []
+        def slow(response):
+            responses.append(response)
+            time.sleep(1.0)
+        engine.add(self.url("/fast"), slow)
+        for i in range(3):
+            engine.add(self.url("/slow/%d" % i), responses.append)
+        engine.run()
+
+        self.assertEqual(len(responses), 4)
+        for response in responses:
+            self.assertEqual(response.error, None)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.read(), FEED)
+
+    def test_redirect_to_https(self):
+        engine = fetcher.Fetcher(timeout=5)
+        response = self.fetch(engine, self.url("/secure"))
+        self.assert_(isinstance(response.error, fetcher.UnsupportedScheme))
+
+        expected = fetcher.Response("https://localhost/feed", 200, data=FEED)
+        response = self.fetch(engine, self.url("/secure"),
+                              fallback=lambda: expected)
+        self.assert_(response is expected)
+
+    def test_other_schemes(self):
+        engine = fetcher.Fetcher(timeout=5)
+        responses = []
+        for i in range(3):
+            engine.add("https://localhost/%d" % i, responses.append,
+                       fallback=lambda i=i: "fallback %d" % i)
+        engine.add(self.url("/feed"), responses.append)
+        engine.run()
+
+        self.assertEqual(len(responses), 4)
+        self.assertEqual([ r for r in responses if isinstance(r, str) ],
+                         [ "fallback %d" % i for i in range(3) ])
+
+    def test_next_address(self):
+        # Nothing listens on the first address, as with a broken IPv6 route
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        def getaddrinfo(host, port, *args):
+            return [ (socket.AF_INET, socket.SOCK_STREAM, 6, "",
+                      ("127.0.0.1", closed_port)),
+                     (socket.AF_INET, socket.SOCK_STREAM, 6, "",
+                      ("127.0.0.1", port)) ]
+        socket.getaddrinfo = getaddrinfo
+
+        engine = fetcher.Fetcher(timeout=5)
+        response = self.fetch(engine, self.url("/feed"))
+        self.assertEqual(response.error, None)
+        self.assertEqual(response.read(), FEED)
+
+
+if __name__ == "__main__":
+    unittest.main()
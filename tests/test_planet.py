@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""Tests for updating planet.Channel from its feed.
+
+Run from the top of the tree with: python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import ConfigParser
+
+import planet
+
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Feed</title><link>http://example.com/</link>
+%s
+</channel></rss>"""
+
+ITEM = """<item><title>%(id)s</title><guid>urn:%(id)s</guid>
+<pubDate>Thu, %(day)02d Jan 2026 12:00:00 GMT</pubDate></item>"""
+
+# Items, newest first, and the day of the month each was published on
+ITEMS = [ ("e", 5), ("d", 4), ("c", 3), ("b", 2), ("a", 1) ]
+
+
+class TruncatedExpiryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.url = os.path.join(self.directory, "feed.xml")
+        self.config = ConfigParser.ConfigParser()
+        self.config.add_section("Planet")
+        self.config.set("Planet", "cache_directory",
+                        os.path.join(self.directory, "cache"))
+        self.config.add_section(self.url)
+        self.planet = planet.Planet(self.config)
+        self.planet.cache_directory = self.config.get("Planet",
+                                                      "cache_directory")
+        self.planet.new_feed_items = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def update(self, items, **options):
+        """Update the channel from a feed of the items, with the options."""
+        f = open(self.url, "w")
+        f.write(FEED % "\n".join([ ITEM % { "id": id, "day": day }
+                                   for id, day in items ]))
+        f.close()
+        for option, value in options.items():
+            self.config.set(self.url, option, str(value))
+
+        channel = planet.Channel(self.planet, self.url)
+        channel.update()
+        ids = [ item.id for item in channel.items(hidden=1, sorted=1) ]
+        channel._cache.close()
+        return ids
+
+    def test_max_entries(self):
+        self.update(ITEMS)
+
+        # "d" was replaced, within the three entries read; "b" and "a"
+        # weren't read, so are kept
+        ids = self.update([ ("f", 6), ("e", 5), ("c", 3), ("b", 2), ("a", 1) ],
+                          max_entries=3)
+        self.assertEqual(ids, [ "urn:f", "urn:e", "urn:c", "urn:b", "urn:a" ])
+
+    def test_stop_after_known(self):
+        self.update(ITEMS)
+
+        # Parsing stops at "c", the second known entry in a row: "d" was
+        # replaced before it, and "b" and "a" weren't read, so are kept
+        ids = self.update([ ("f", 6), ("e", 5), ("c", 3), ("b", 2), ("a", 1) ],
+                          stop_after_known=2)
+        self.assertEqual(ids, [ "urn:f", "urn:e", "urn:c", "urn:b", "urn:a" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Tests for planet.sanitize, and sanitizing feeds in one pass and in two.
+
+Run from the top of the tree with: python -m unittest discover -s tests
+"""
+
+import os
+import glob
+import random
+import unittest
+from xml.sax.saxutils import escape
+
+import planet
+from planet import feedparser
+from planet import sanitize
+
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xml:base="http://example.com/blog/">
+<title>Feed</title><id>urn:feed</id><updated>2026-01-01T00:00:00Z</updated>
+<entry><id>urn:one</id><updated>2026-01-01T00:00:00Z</updated>
+<title type="html">%(markup)s</title>
+<subtitle type="html">%(markup)s</subtitle>
+<summary type="html">%(markup)s</summary>
+<content type="html">%(markup)s</content>
+</entry></feed>"""
+
+# Fixture feeds, whose markup the sanitizer engines are compared on
+FEEDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feeds")
+
+# Pieces of markup put together at random to compare the engines on
+PIECES = ['<p>', '</p>', '<i>', '</i>', '<b>', '<B>', '<b/>', '<table>',
+          '<tr>', '<td>', '</td>', '</table>', '<ul><li>', '</ul>', '<br>',
+          '<br/>', '<a href="/rel">', '<a href="x/y?a=1&amp;b=2">', '</a>',
+          "<a href='http://example.com/'>", '<a title="&amp;&#233;&bogus;">',
+          '<A HREF=x>', '<img src="i.png" alt="x">', '<IMG SRC=i.png>',
+          '<div style="color:red" onclick="e">', '</div>', '<span class=x>',
+          '</span>', '<blockquote cite="q">', '</blockquote>', '<q cite="c">',
+          '<form action="f">', '<input src="s" usemap="#m">',
+          '<font color=red>', '<script>', '</script>', '<style>', '</style>',
+          '<applet>', '</applet>', '<!-- c -->', '<!-- c', '<?pi?>',
+          '<!DOCTYPE x>', '<![CDATA[ z ]]>', 'text', 'x < y', ' & ', '&amp;',
+          '&lt;', '&#169;', '&#x41;', '&nbsp;', '&bogus;', '&#', '<', '>',
+          '</', '"', "'", '<a href="x', ' caf\xc3\xa9 ', '\xff', '\n']
+
+# Markup, and what both ways of sanitizing it store
+SAME = [("more < less", "more  less"),
+        ("<p>a <i>b<table><tr><td>c",
+         "<p>a <i>b<table><tr><td>c</td></tr></table></i></p>"),
+        ('<a href="post/1">x</a> <img src="/i.png">',
+         '<a href="http://example.com/blog/post/1">x</a> '
+         '<img src="http://example.com/i.png" />'),
+        ("a &bogus; b", "a &amp;bogus b"),
+        ("a</style> <b>b</b>", "a <b>b</b>"),
+        ("caf\xc3\xa9 <b>x", "caf\xc3\xa9 <b>x</b>"),
+        ("  x <script>alert(1)</script> y  ", "x  y")]
+
+# Markup, and what two passes and a single pass store for it; see
+# planet.sanitize_feed()
+DIFFERENT = [("<style>p {color: red}</style>text", "p {color: red}text", "text"),
+             ("a <script>x <b>y</b>", "a <b></b>", "a"),
+             ("<i>x <foo>", "<i>x</i>", "<i>x </i>")]
+
+
+class SinglePassTest(unittest.TestCase):
+    def setUp(self):
+        self.setting = feedparser.HTML_SANITIZER
+
+    def tearDown(self):
+        feedparser.HTML_SANITIZER = self.setting
+
+    def parse(self, markup):
+        """Return the entry parsed with two passes and with a single pass."""
+        data = FEED % { "markup": escape(markup) }
+        entries = []
+        for sanitizer in (None, sanitize.HTML):
+            feedparser.HTML_SANITIZER = sanitizer
+            entries.append(planet.parse_feed(data).entries[0])
+        return entries
+
+    def values(self, entry):
+        return [ entry.title, entry.subtitle, entry.summary,
+                 entry.content[0].value ]
+
+    def test_same(self):
+        for markup, expected in SAME:
+            two, one = self.parse(markup)
+            self.assertEqual(self.values(two), [ expected ] * 4, markup)
+            self.assertEqual(self.values(one), [ expected ] * 4, markup)
+            for value in self.values(one):
+                self.assertEqual(type(value), str)
+
+    def test_different(self):
+        for markup, two_passes, single_pass in DIFFERENT:
+            two, one = self.parse(markup)
+            self.assertEqual(self.values(two), [ two_passes ] * 4, markup)
+            self.assertEqual(self.values(one), [ single_pass ] * 4, markup)
+
+    def test_detail(self):
+        two, one = self.parse("more < less")
+        self.assertEqual(two.title_detail.value, u"more < less")
+        self.assertEqual(one.title_detail.value, u"more  less")
+
+
+class EngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = sanitize.ENGINE
+        self.setting = feedparser.HTML_SANITIZER
+        self.sanitize = sanitize._HTML
+
+    def tearDown(self):
+        sanitize.ENGINE = self.engine
+        feedparser.HTML_SANITIZER = self.setting
+        sanitize._HTML = self.sanitize
+
+    def fixture_calls(self):
+        """Return the calls made to sanitize the markup in the fixtures.
+
+        They're collected with and without the base URIs used for a
+        single pass.
+        """
+        calls = []
+        def collect(htmlSource, encoding='utf8', baseuri=None):
+            calls.append((htmlSource, encoding, baseuri))
+            return self.sanitize(htmlSource, encoding, baseuri)
+        sanitize._HTML = collect
+        try:
+            for sanitizer in (None, sanitize.HTML):
+                feedparser.HTML_SANITIZER = sanitizer
+                for filename in glob.glob(os.path.join(FEEDS, "*.xml")):
+                    planet.parse_feed(open(filename, "rb").read())
+        finally:
+            sanitize._HTML = self.sanitize
+        return calls
+
+    def generated_calls(self, count=2000):
+        """Return calls sanitizing random markup, with and without a base."""
+        generator = random.Random(0)
+        calls = []
+        for i in range(count):
+            markup = "".join([ generator.choice(PIECES)
+                               for j in range(generator.randint(0, 12)) ])
+            calls.append((markup, 'utf8', None))
+            calls.append((markup, 'utf8', "http://example.com/base/"))
+        return calls
+
+    def results(self, engine, calls):
+        sanitize.ENGINE = engine
+        results = []
+        for call in calls:
+            try:
+                results.append(self.sanitize(*call))
+            except Exception, e:
+                results.append(e.__class__)
+        return results
+
+    def test_same_results(self):
+        calls = self.fixture_calls()
+        self.assert_(calls, "no markup in the fixture feeds")
+        calls.extend(self.generated_calls())
+        expected = self.results("sgmllib", calls)
+        results = self.results("regex", calls)
+        for call, result, value in zip(calls, results, expected):
+            self.assertEqual(result, value, "regex sanitized %r as %r, not %r"
+                             % (call, result, value))
+
+    def test_engines(self):
+        for engine in ("sgmllib", "regex"):
+            sanitize.ENGINE = engine
+            for markup, expected in (("a</style> <b>b</b>", "a <b>b</b>"),
+                                     ("a <style>b</style> c", "a  c"),
+                                     ("a &bogus; &copy;", "a &amp;bogus &copy;")):
+                self.assertEqual(sanitize.HTML(markup), expected, engine)
+
+
+if __name__ == "__main__":
+    unittest.main()